@@ -67,3 +67,7 @@ default_plot_output = config_ini.string('default_plot_output', 'pdf')
 loglevel = config_ini.string('logging', '')
 if loglevel:
     set_logging(loglevel)
+if config_ini.hasKey('fft_backend') or config_ini.hasKey('fft_workers'):
+    from getdist.convolve import setFFTBackend
+
+    setFFTBackend(config_ini.string('fft_backend', 'scipy'), config_ini.int('fft_workers', 1))
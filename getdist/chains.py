@@ -1,6 +1,8 @@
 import os
 import numpy as np
 import re
+import fnmatch
+import ast
 from packaging import version
 from getdist.paramnames import ParamNames, ParamInfo, escapeLatex
 from getdist.convolve import autoConvolve
@@ -9,6 +11,7 @@ import pickle
 import logging
 from copy import deepcopy
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from typing import Sequence, Any, Optional, Union, List
 
 # whether to write to terminal chain names and burn in details when loaded from file
@@ -160,6 +163,114 @@ def getSignalToNoise(C, noise=None, R=None, eigs_only=False):
         return w, U
 
 
+# maximum number of array elements in temporary row blocks used for covariances
+cov_block_size = 2 ** 21
+
+
+def _row_blocks(samples, columns=None, where=None):
+    """
+    Generator giving (row selection, block of sample values) for blocks of rows, so that the temporary memory
+    used is bounded by cov_block_size elements.
+
+    :param samples: n_samples x n_parameters array
+    :param columns: optional list of column indices to use
+    :param where: optional boolean mask or array of indices of rows to use
+    """
+    n = samples.shape[1] if columns is None else len(columns)
+    block = max(1, cov_block_size // max(n, 1))
+    if where is None:
+        for start in range(0, samples.shape[0], block):
+            rows = slice(start, start + block)
+            yield rows, samples[rows] if columns is None else samples[rows, columns]
+    else:
+        where = np.asarray(where)
+        if where.dtype == bool:
+            where = np.flatnonzero(where)
+        for start in range(0, where.size, block):
+            rows = where[start:start + block]
+            yield rows, samples[rows] if columns is None else samples[np.ix_(rows, columns)]
+
+
+def _weighted_means(samples, weights, columns=None, where=None):
+    """
+    Weighted means of the columns of samples, accumulated over blocks of rows.
+
+    :param samples: n_samples x n_parameters array
+    :param weights: array of weights
+    :param columns: optional list of column indices to use
+    :param where: optional boolean mask or array of indices of rows to use
+    :return: array of means
+    """
+    total = np.zeros(samples.shape[1] if columns is None else len(columns))
+    norm = 0.
+    for rows, block in _row_blocks(samples, columns, where):
+        total += weights[rows].dot(block)
+        norm += np.sum(weights[rows])
+    return total / norm
+
+
+def _weighted_cov_sum(samples, weights, means, diagonal=False, columns=None, where=None):
+    """
+    Weighted sum of outer products of differences from the means, sum_i w_i (x_i - mean)(x_i - mean)^T,
+    accumulated in float64 as matrix products over blocks of rows so that temporary memory use is bounded by
+    cov_block_size.
+
+    :param samples: n_samples x n_parameters array
+    :param weights: array of weights
+    :param means: array of means for each (used) column of samples
+    :param diagonal: if True, only calculate the diagonal (weighted sum of squared differences)
+    :param columns: optional list of column indices to use
+    :param where: optional boolean mask or array of indices of rows to use
+    :return: n_parameters x n_parameters matrix, or array of diagonal values if diagonal is True
+    """
+    n = len(means)
+    res = np.zeros(n) if diagonal else np.zeros((n, n))
+    negative_weights = np.any(weights < 0)
+    for rows, block in _row_blocks(samples, columns, where):
+        diffs = block - means
+        if diagonal:
+            res += weights[rows].dot(diffs ** 2)
+        elif negative_weights:
+            res += (weights[rows][:, np.newaxis] * diffs).T.dot(diffs)
+        else:
+            # scale by sqrt(weights) so the product is X^T X, for which BLAS can use a symmetric rank-k update
+            diffs *= np.sqrt(weights[rows])[:, np.newaxis]
+            res += diffs.T.dot(diffs)
+    return res
+
+
+def _gelman_rubin_eigenvalues(means, chain_means, chain_covs):
+    """
+    Eigenvalues of var(mean)/mean(var) in orthogonalized parameters, given per-chain moments.
+
+    :param means: overall mean of each parameter
+    :param chain_means: n_chains x nparam array of chain means
+    :param chain_covs: n_chains x nparam x nparam array of chain covariances
+    :return: array of eigenvalues, or None if the mean chain covariance is not positive definite
+    """
+    nchains = chain_means.shape[0]
+    diffs = chain_means - means
+    meanscov = diffs.T.dot(diffs) / (nchains - 1)
+    meancov = np.sum(chain_covs, axis=0) / nchains
+    w, U = np.linalg.eigh(meancov)
+    if np.min(w) > 0:
+        U /= np.sqrt(w)
+        return np.linalg.eigvalsh(np.dot(U.T, meanscov).dot(U))
+    else:
+        return None
+
+
+# maximum number of columns sorted together when calculating quantiles
+quantile_block_columns = 16
+
+# number of sample rows evaluated at a time for lazy derived parameters
+derived_chunk_size = 2 ** 16
+
+# namespace for evaluating derived parameter expressions: numpy ufuncs can be used directly, other functions via np.
+_derived_namespace = dict(((name, func) for name, func in vars(np).items() if isinstance(func, np.ufunc)),
+                          np=np, __builtins__={})
+
+
 def covToCorr(cov, copy=True):
     """
     Convert covariance matrix to correlation matrix
@@ -184,6 +295,24 @@ class ParSamples:
     pass
 
 
+class _ChunkParSamples(ParSamples):
+    """
+    Parameter arrays for a chunk of sample rows, evaluating any lazy derived parameters when first accessed
+    """
+
+    def __init__(self, samples, rows):
+        self._samples = samples
+        self._rows = rows
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._samples.lazy_derived:
+            raise AttributeError(name)
+        self._samples.materializeDerived([name])
+        value = self._samples.samples[self._rows, self._samples.paramNames.numberOfName(name)]
+        setattr(self, name, value)
+        return value
+
+
 # noinspection PyAttributeOutsideInit
 class WeightedSamples:
     """
@@ -204,6 +333,8 @@ class WeightedSamples:
     n: Any
     numrows: Any
     paramNames: Optional[ParamNames]
+    # names of the array attributes shared (as read-only views) with copies, see _sharedArraysMemo
+    _shared_arrays = frozenset()
 
     def __init__(self, filename=None, ignore_rows=0, samples=None, weights=None, loglikes=None, name_tag=None,
                  label=None, files_are_chains=True, min_weight_ratio=1e-30):
@@ -316,8 +447,98 @@ class WeightedSamples:
         self.correlationMatrix = None
         self.vars = None
         self.sddev = None
+        self._sort_cache = {}
         self.needs_update = True
 
+    def _columnChanged(self, j):
+        """
+        Update saved statistics after column j of the samples has been changed or appended, keeping those of the
+        other columns. If statistics have not been calculated yet, they are left to be updated in full later.
+
+        :param j: index of the changed column (self.n - 1 for a new column)
+        """
+        self.diffs = None
+        self._sort_cache.pop(j, None)
+        if self.needs_update or self.means is None:
+            return
+        paramVec = self.samples[:, j]
+        mean = self.weights.dot(paramVec) / self.norm
+        weightdiffs = self.weights * (paramVec - mean)
+        new = j == self.means.size
+        if new:
+            self.means = np.append(self.means, mean)
+        else:
+            self.means[j] = mean
+        if self.vars is not None:
+            var = weightdiffs.dot(paramVec - mean) / self.norm
+            if new:
+                self.vars = np.append(self.vars, var)
+            else:
+                self.vars[j] = var
+            self.sddev = np.sqrt(self.vars)
+        if self.fullcov is not None:
+            crosscov = (weightdiffs.dot(self.samples) - np.sum(weightdiffs) * self.means) / self.norm
+            if new:
+                self.fullcov = np.pad(self.fullcov, ((0, 1), (0, 1)))
+            self.fullcov[j, :] = crosscov
+            self.fullcov[:, j] = crosscov
+        self.correlationMatrix = None
+
+    def _columnsDeleted(self, indices):
+        """
+        Update saved statistics after columns have been deleted from the samples, keeping those of the
+        remaining columns.
+
+        :param indices: list of indices of the deleted columns
+        """
+        self.diffs = None
+        kept = np.delete(np.arange(self.n + len(indices)), indices)
+        self._sort_cache = {new: self._sort_cache[old] for new, old in enumerate(kept) if old in self._sort_cache}
+        if self.means is not None:
+            self.means = self.means[kept]
+        if self.vars is not None:
+            self.vars = self.vars[kept]
+            self.sddev = self.sddev[kept]
+        if self.fullcov is not None:
+            self.fullcov = self.fullcov[np.ix_(kept, kept)]
+        self.correlationMatrix = None
+
+    def _sharedArraysMemo(self):
+        """
+        Makes read-only views of the samples, weights and loglikes arrays to share with a copy
+        (copy-on-write, see :meth:`_unshare`). The arrays of this instance stay writable, but methods
+        changing them in place make a private copy first so that copies are not affected.
+
+        :return: a deepcopy memo dictionary mapping the arrays to their read-only views
+        """
+        memo = {}
+        for attr in ('samples', 'weights', 'loglikes'):
+            arr = getattr(self, attr)
+            if isinstance(arr, np.ndarray):
+                view = arr.view()
+                view.flags.writeable = False
+                memo[id(arr)] = view
+                self._shared_arrays = self._shared_arrays | {attr}
+        return memo
+
+    def _unshare(self, *attrs):
+        """
+        Makes private copies of any arrays that may be shared with copies, before changing them in place.
+
+        :param attrs: names of the array attributes to be changed
+        """
+        for attr in attrs:
+            arr = getattr(self, attr)
+            if isinstance(arr, np.ndarray) and (not arr.flags.writeable or attr in self._shared_arrays):
+                setattr(self, attr, arr.copy())
+            self._shared_arrays = self._shared_arrays - {attr}
+
+    def __getstate__(self):
+        # sort orders are cheap to regenerate, don't save them in pickles (or copies)
+        state = self.__dict__.copy()
+        state['_sort_cache'] = {}
+        return state
+
     def _makeParamvec(self, par):
         if isinstance(par, _int_types):
             if 0 <= par < self.n:
@@ -699,22 +920,20 @@ class WeightedSamples:
                       (where x>=5 would mean only process samples with x>=5).
         :return: The covariance matrix
         """
-        diffs = self.mean_diffs(pars, where)
-        if pars is None:
-            pars = list(range(self.n))
-        n = len(pars)
-        cov = np.empty((n, n))
-        if where is not None:
-            weights = self.weights[where]
+        samples, columns = self.samples, None
+        if pars is not None:
+            if all(isinstance(par, _int_types) and par >= 0 for par in pars):
+                columns = list(pars)
+                if any(par >= self.n for par in columns):
+                    raise ParamError('Parameter index out of range in %s' % columns)
+            else:
+                samples = np.column_stack([self._makeParamvec(par) for par in pars]).astype(np.float64)
+        if where is None and samples is self.samples:
+            means = self.getMeans() if columns is None else self.getMeans()[columns]
         else:
-            weights = self.weights
-        for i, diff in enumerate(diffs):
-            weightdiff = diff * weights
-            for j in range(i, n):
-                cov[i, j] = weightdiff.dot(diffs[j])
-                cov[j, i] = cov[i, j]
-        cov /= self.get_norm(where)
-        return cov
+            means = _weighted_means(samples, self.weights, columns, where)
+        cov = _weighted_cov_sum(samples, self.weights, means, columns=columns, where=where)
+        return cov / self.get_norm(where)
 
     def corr(self, pars=None):
         """
@@ -785,6 +1004,8 @@ class WeightedSamples:
         :return: :class:`~.chains.ParamConfidenceData` instance
         """
         if weights is None:
+            if isinstance(paramVec, _int_types) and 0 <= paramVec < self.n:
+                return self._getCachedConfidenceData(paramVec, start, end)
             weights = self.weights
         paramVec = self._makeParamvec(paramVec)[start:end]
         indices = paramVec.argsort()
@@ -793,6 +1014,29 @@ class WeightedSamples:
                                    indexes=indices,
                                    cumsum=np.cumsum(weights[start + indices]))
 
+    def _getCachedConfidenceData(self, j, start=0, end=None):
+        """
+        Get :class:`~.chains.ParamConfidenceData` for column j, using the sort order of the full column
+        which is cached until the samples or weights change. For a contiguous sub-range of samples the sort order
+        is obtained by filtering the full sorted order, rather than sorting again.
+        """
+        paramVec = self._makeParamvec(j)
+        full = self._sort_cache.get(j)
+        if full is None:
+            indices = paramVec.argsort()
+            full = ParamConfidenceData(paramVec=paramVec, norm=self.get_norm(), indexes=indices,
+                                       cumsum=np.cumsum(self.weights[indices]))
+            self._sort_cache[j] = full
+        start, end, _ = slice(start, end).indices(self.numrows)
+        if start == 0 and end == self.numrows:
+            return full
+        indices = full.indexes
+        indices = indices[(indices >= start) & (indices < end)] - start
+        return ParamConfidenceData(paramVec=full.paramVec[start:end],
+                                   norm=np.sum(self.weights[start:end]),
+                                   indexes=indices,
+                                   cumsum=np.cumsum(self.weights[start + indices]))
+
     def confidence(self, paramVec, limfrac, upper=False, start=0, end=None, weights=None):
         """
         Calculate sample confidence limits, not using kernel densities just counting samples in the tails
@@ -818,6 +1062,70 @@ class WeightedSamples:
         ix = np.searchsorted(d.cumsum, target)
         return d.paramVec[d.indexes[np.minimum(ix, d.indexes.shape[0] - 1)]]
 
+    def confidences(self, queries, upper=False):
+        """
+        Calculate many sample confidence limits at once (see :meth:`confidence`). Queries for the same parameter
+        and sample range share the same (cached) sort of the parameter values.
+
+        :param queries: list of (param, limfrac) or (param, limfrac, start, end) tuples, where param is
+                        an int index of the parameter (or array of parameter values), limfrac is the tail
+                        fraction or array of fractions, and start, end give the range of samples to use
+        :param upper: True to get upper limits, False for lower limits
+        :return: list of confidence limits (or arrays of limits), one for each query
+        """
+        data = {}
+        results = []
+        for query in queries:
+            par, limfrac, start, end = tuple(query) + (0, None)[len(query) - 2:]
+            key = (par if isinstance(par, _int_types) else id(par), start, end)
+            d = data.get(key)
+            if d is None:
+                d = self.initParamConfidenceData(par, start, end)
+                data[key] = d
+            results.append(self.confidence(d, limfrac, upper))
+        return results
+
+    def quantiles(self, params=None, probs=(0.025, 0.5, 0.975), max_workers=None):
+        """
+        Calculate weighted sample quantiles of many parameters at once, not using kernel densities, just
+        counting samples. Columns are sorted in blocks (and the sort orders cached, as for :meth:`confidence`),
+        with all requested probabilities found from one cumulative sum of the weights for each parameter.
+
+        :param params: list of int indices of parameters (or arrays of parameter values), default all parameters
+        :param probs: probability or array of probabilities, e.g. [0.025, 0.975] for 95% two-tail limits
+        :param max_workers: maximum number of threads to use for sorting; default 1 (no threads)
+        :return: array of quantiles for each parameter (len(params) x len(probs))
+        """
+        if self.needs_update:
+            self.updateBaseStatistics()
+        if params is None:
+            params = range(self.n)
+        params = list(params)
+        probs = np.atleast_1d(np.asarray(probs, dtype=np.float64))
+        columns = sorted(set(j for j in params if isinstance(j, _int_types) and 0 <= j < self.n
+                             and j not in self._sort_cache))
+        blocks = [columns[i:i + quantile_block_columns] for i in range(0, len(columns), quantile_block_columns)]
+
+        def sort_block(block):
+            # one sort call per block of columns (copied to contiguous rows), caching the full sort order of each
+            orders = np.argsort(np.ascontiguousarray(self.samples[:, block].T), axis=1)
+            for j, indexes in zip(block, orders):
+                self._sort_cache[j] = ParamConfidenceData(paramVec=self.samples[:, j], norm=self.get_norm(),
+                                                          indexes=indexes, cumsum=np.cumsum(self.weights[indexes]))
+
+        def quantile(par):
+            d = self._getCachedConfidenceData(par) if isinstance(par, _int_types) \
+                else self.initParamConfidenceData(par)
+            return self.confidence(d, probs)
+
+        if max_workers == 1 or max_workers is None or len(blocks) < 2:
+            for block in blocks:
+                sort_block(block)
+            return np.array([quantile(par) for par in params]).reshape(len(params), probs.size)
+        with ThreadPoolExecutor(max_workers) as executor:
+            list(executor.map(sort_block, blocks))
+            return np.array(list(executor.map(quantile, params))).reshape(len(params), probs.size)
+
     def getSignalToNoise(self, params, noise=None, R=None, eigs_only=False):
         """
         Returns w, M, where w is the eigenvalues of the signal to noise (small y better constrained)
@@ -956,6 +1264,7 @@ class WeightedSamples:
         :param logLikes: array of -log(likelihood) for each sample to adjust
         """
         scale = np.min(logLikes)
+        self._unshare('weights', 'loglikes')
         if self.loglikes is not None:
             self.loglikes += logLikes
         self.weights = np.asarray(self.weights, dtype=np.float64)
@@ -970,6 +1279,7 @@ class WeightedSamples:
         """
         MaxL = np.max(self.loglikes)
         newL = self.loglikes * cool
+        self._unshare('weights')
         self.weights = np.asarray(self.weights, dtype=np.float64)
         self.weights *= np.exp(-(newL - self.loglikes) - (MaxL * (1 - cool)))
         self.loglikes = newL
@@ -1080,6 +1390,7 @@ class Chains(WeightedSamples):
 
         self.chains = None
         self.chain_offsets = None
+        self.lazy_derived = {}
         super().__init__(**kwargs)
         self.jobItem = jobItem
         self.ignore_lines = float(kwargs.get('ignore_rows', 0))
@@ -1185,6 +1496,22 @@ class Chains(WeightedSamples):
         self.index = index
         return self.index
 
+    def quantiles(self, params=None, probs=(0.025, 0.5, 0.975), max_workers=None):
+        """
+        Calculate weighted sample quantiles of many parameters at once (see
+        :meth:`~.chains.WeightedSamples.quantiles`).
+
+        :param params: list of parameter names or indices (or arrays of parameter values), default all parameters
+        :param probs: probability or array of probabilities, e.g. [0.025, 0.975] for 95% two-tail limits
+        :param max_workers: maximum number of threads to use for sorting; default 1 (no threads)
+        :return: array of quantiles for each parameter (len(params) x len(probs))
+        """
+        if params is not None:
+            params = [self._parAndNumber(par)[0] if isinstance(par, (str, ParamInfo)) else par for par in params]
+            if any(par is None for par in params):
+                raise ParamError('Unknown parameter in %s' % params)
+        return super().quantiles(params, probs, max_workers)
+
     def _parAndNumber(self, name):
         """
         Get index and ParamInfo for a name or index
@@ -1195,6 +1522,9 @@ class Chains(WeightedSamples):
         if isinstance(name, ParamInfo):
             name = name.name
         if isinstance(name, str):
+            if name not in self.index and name in self.lazy_derived:
+                self.materializeDerived([name])
+                self._getParamIndices()
             name = self.index.get(name, None)
             if name is None:
                 return None, None
@@ -1247,8 +1577,10 @@ class Chains(WeightedSamples):
         for example samples.getParams().name1 would be the vector of samples with name 'name1'
 
         :return: A :class:`~.chains.ParSamples` object containing all the parameter vectors, with attributes
-                given by the parameter names
+                given by the parameter names (including any lazy derived parameters, which are evaluated)
         """
+        if self.lazy_derived:
+            self.materializeDerived()
         pars = ParSamples()
         self.setParams(pars)
         return pars
@@ -1276,6 +1608,9 @@ class Chains(WeightedSamples):
             par = par.name
         if isinstance(par, str):
             index = self.index.get(par)
+            if index is None and par in self.lazy_derived:
+                self.materializeDerived([par])
+                index = self.index.get(par)
             if index is not None:
                 return self.samples[:, index]
             if par == 'weight':
@@ -1296,6 +1631,8 @@ class Chains(WeightedSamples):
 
         :return: self after updating statistics.
         """
+        # samples may have been changed in place, so cached sort orders are no longer valid
+        self._sort_cache = {}
         self.setMeans()
         self.getVars()
         self.mean_mult = self.norm / self.numrows
@@ -1315,8 +1652,130 @@ class Chains(WeightedSamples):
         """
         if self.paramNames.parWithName(name):
             raise ValueError('Parameter with name %s already exists' % name)
-        self.changeSamples(np.c_[self.samples, paramVec])
-        return self.paramNames.addDerived(name, **kwargs)
+        self.samples = np.c_[self.samples, paramVec]
+        self.n = self.samples.shape[1]
+        par = self.paramNames.addDerived(name, **kwargs)
+        self._columnChanged(self.n - 1)
+        return par
+
+    def changeDerived(self, paramVec, name):
+        """
+        Replaces the values of an existing parameter. Only statistics for that parameter are recalculated.
+
+        :param paramVec: The new vector of parameter values
+        :param name: The name of the parameter to change
+        :return: The parameter's :class:`~.paramnames.ParamInfo` object
+        """
+        j = self.paramNames.numberOfName(name)
+        if j < 0:
+            raise ParamError('Parameter %s not found' % name)
+        self._unshare('samples')
+        self.samples[:, j] = paramVec
+        self._columnChanged(j)
+        return self.paramNames.names[j]
+
+    def _columnChanged(self, j):
+        super()._columnChanged(j)
+        if not self.needs_update:
+            self.index[self.paramNames.names[j].name] = j
+
+    def _columnsDeleted(self, indices):
+        super()._columnsDeleted(indices)
+        self.paramNames.deleteIndices(indices)
+        if not self.needs_update:
+            self._getParamIndices()
+
+    def addDerivedExpr(self, name, expr, **kwargs):
+        """
+        Declares a derived parameter that is calculated lazily from the existing parameters. The values are only
+        evaluated (in chunks of rows) and added to the samples when the parameter is first needed, e.g. for a
+        density, statistic or plot, or when :meth:`materializeDerived` is called.
+
+        For example::
+
+            samples.addDerivedExpr('S8', 'sigma8*sqrt(omegam/0.3)')
+
+        :param name: The name for the new parameter
+        :param expr: string expression in terms of parameter names (numpy ufuncs such as sqrt can be used
+                     directly, other numpy functions and constants as np.xxx), or a function taking a
+                     :class:`~.chains.ParSamples` object with parameter vectors for a chunk of samples
+                     (including other lazy derived parameters) and returning the derived parameter values.
+        :param kwargs: arguments for :meth:`addDerived` when the parameter is evaluated, e.g. label
+        """
+        if self.paramNames.parWithName(name) or name in self.lazy_derived:
+            raise ValueError('Parameter with name %s already exists' % name)
+        if isinstance(expr, str):
+            compile(expr, '<%s>' % name, 'eval')
+        elif not callable(expr):
+            raise ValueError('expr must be a string expression or a function')
+        self.lazy_derived[name] = (expr, kwargs)
+
+    def materializeDerived(self, names=None):
+        """
+        Evaluate lazy derived parameters declared with :meth:`addDerivedExpr`, adding them to the samples.
+
+        :param names: list of parameter names or name patterns (with wildcards) to evaluate,
+                      or None to evaluate all lazy derived parameters
+        :return: list of :class:`~.paramnames.ParamInfo` for the newly evaluated parameters
+        """
+        added = []
+        for name in self._matchLazyDerived(names):
+            if not self.paramNames.parWithName(name):
+                expr, kwargs = self.lazy_derived[name]
+                added.append(self.addDerived(self._evaluateDerived(expr), name, **kwargs))
+        return added
+
+    def dropLazyDerived(self, names=None):
+        """
+        Removes the values of evaluated lazy derived parameters from the samples to free memory.
+        The parameters remain declared, and are evaluated again when next needed.
+
+        :param names: list of parameter names or name patterns (with wildcards) to drop, or None to drop all
+        """
+        indices = [self.paramNames.numberOfName(name) for name in self._matchLazyDerived(names)]
+        indices = sorted(i for i in indices if i >= 0)
+        if indices:
+            self.samples = np.delete(self.samples, indices, 1)
+            self.n = self.samples.shape[1]
+            self._columnsDeleted(indices)
+
+    def _matchLazyDerived(self, names):
+        if isinstance(names, str):
+            names = [names]
+        return [name for name in self.lazy_derived if names is None or
+                any(fnmatch.fnmatchcase(name, getattr(pattern, 'name', pattern)) for pattern in names)]
+
+    def _evaluateDerived(self, expr):
+        """
+        Evaluates a derived parameter expression or function over chunks of sample rows.
+
+        :param expr: string expression or function
+        :return: array of values
+        """
+        if isinstance(expr, str):
+            names = set(node.id for node in ast.walk(ast.parse(expr, mode='eval')) if isinstance(node, ast.Name))
+            unknown = [name for name in names if name not in _derived_namespace and name not in self.lazy_derived
+                       and not self.paramNames.parWithName(name)]
+            if unknown:
+                raise ParamError('Unknown parameter(s) %s in derived expression: %s' % (', '.join(sorted(unknown)), expr))
+            self.materializeDerived([name for name in names if name in self.lazy_derived])
+            columns = dict((name, self.paramNames.numberOfName(name)) for name in names
+                           if self.paramNames.parWithName(name))
+            expr = compile(expr, '<derived>', 'eval')
+        else:
+            columns = dict((par.name, i) for i, par in enumerate(self.paramNames.names))
+        result = np.empty(self.samples.shape[0])
+        for start in range(0, self.samples.shape[0], derived_chunk_size):
+            rows = slice(start, start + derived_chunk_size)
+            if callable(expr):
+                pars = _ChunkParSamples(self, rows)
+                for name, i in columns.items():
+                    setattr(pars, name, self.samples[rows, i])
+                result[rows] = expr(pars)
+            else:
+                result[rows] = eval(expr, _derived_namespace,
+                                    dict((name, self.samples[rows, i]) for name, i in columns.items()))
+        return result
 
     def loadChains(self, root, files_or_samples: Sequence, weights=None, loglikes=None,
                    ignore_lines=None):
@@ -1400,25 +1859,45 @@ class Chains(WeightedSamples):
                           Defaults to all the separate chains in this instance.
         :return: array of  var(mean)/mean(var) for orthogonalized parameters
         """
-        if chainlist is None:
-            chainlist = self.getSeparateChains()
         nparam = nparam or self.paramNames.numNonDerived()
-        meanscov = np.zeros((nparam, nparam))
-        means = self.getMeans()[:nparam]
-        meancov = np.zeros(meanscov.shape)
-        for chain in chainlist:
-            diff = chain.getMeans()[:nparam] - means
-            meanscov += np.outer(diff, diff)
-            meancov += chain.getCov(nparam)
-        meanscov /= (len(chainlist) - 1)
-        meancov /= len(chainlist)
-        w, U = np.linalg.eigh(meancov)
-        if np.min(w) > 0:
-            U /= np.sqrt(w)
-            D = np.linalg.eigvalsh(np.dot(U.T, meanscov).dot(U))
-            return D
-        else:
-            return None
+        _, chain_means, chain_covs = self.getChainStatistics(nparam, chainlist=chainlist)
+        return _gelman_rubin_eigenvalues(self.getMeans()[:nparam], chain_means, chain_covs)
+
+    def getChainStatistics(self, nparam=None, diagonal=False, chainlist=None):
+        """
+        Gets the normalization, means and covariance of each separate chain. If the chains have been combined,
+        these are calculated directly from the combined samples using the stored chain offsets, without making
+        separate chain objects or arrays of differences from the mean.
+
+        :param nparam: The number of parameters (starting at first), by default uses all of them
+        :param diagonal: if True, return just the variances rather than full covariance matrices
+        :param chainlist: optional list of :class:`~.chains.WeightedSamples` to use instead of the
+                          separate chains in this instance.
+        :return: tuple of arrays norms (n_chains), means (n_chains x nparam), and covariances
+                 (n_chains x nparam x nparam), or variances (n_chains x nparam) if diagonal is True
+        """
+        if nparam is None:
+            nparam = self.n
+        if chainlist is None:
+            if self.chains is not None:
+                chainlist = self.chains
+            elif self.chain_offsets is None:
+                raise WeightedSampleError('Samples were not combined from separate chains')
+            else:
+                if self.needs_update:
+                    self.updateBaseStatistics()
+                chainlist = [(self.samples[off1:off2, :nparam], self.weights[off1:off2])
+                             for off1, off2 in zip(self.chain_offsets[:-1], self.chain_offsets[1:])]
+        if chainlist and isinstance(chainlist[0], WeightedSamples):
+            chainlist = [(chain.samples[:, :nparam], chain.weights) for chain in chainlist]
+        norms = np.empty(len(chainlist))
+        means = np.empty((len(chainlist), nparam))
+        covs = np.empty((len(chainlist), nparam) if diagonal else (len(chainlist), nparam, nparam))
+        for i, (samples, weights) in enumerate(chainlist):
+            norms[i] = np.sum(weights)
+            means[i] = weights.dot(samples) / norms[i]
+            covs[i] = _weighted_cov_sum(samples, weights, means[i], diagonal) / norms[i]
+        return norms, means, covs
 
     def getGelmanRubin(self, nparam=None, chainlist=None):
         """
@@ -1465,7 +1944,7 @@ class Chains(WeightedSamples):
         else:
             for off1, off2 in zip(self.chain_offsets[:-1], self.chain_offsets[1:]):
                 chainlist.append(WeightedSamples(samples=self.samples[off1:off2], weights=self.weights[off1:off2],
-                                                 loglikes=self.loglikes[off1:off2]))
+                                                 loglikes=slice_or_none(self.loglikes, off1, off2)))
         return chainlist
 
     def removeBurnFraction(self, ignore_frac):
@@ -1,5 +1,9 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 import numpy as np
-from scipy import fftpack
+from scipy import fft as scipy_fft
 
 # numbers of the form 2^n3^m5^r, even only and r<=1
 fastFFT = np.array(
@@ -23,43 +27,270 @@ def nearestFFTnumber(x):
     return np.maximum(x, fastFFT[np.searchsorted(fastFFT, x)])
 
 
-def convolve1D(x, y, mode, largest_size=0, cache=None, cache_args=(1, 2)):
+def fastFFTSize(n):
+    """
+    Smallest size >= n that is fast for real FFTs (elementwise if n is an array)
+    """
+    if np.ndim(n):
+        return np.array([scipy_fft.next_fast_len(int(k), True) for k in n])
+    return scipy_fft.next_fast_len(int(n), True)
+
+
+class FFTBackend:
+    """
+    FFT and DCT functions used for the convolutions and kernel bandwidth estimates.
+    Transforms follow the scipy.fft conventions (in particular for the normalization of the inverse DCT).
+
+    :ivar name: 'scipy' (scipy.fft), 'numpy' (numpy.fft, with DCTs from scipy.fft), or 'pyfftw'
+                (pyfftw's scipy.fft interface, caching FFTW plans between calls)
+    :ivar workers: number of threads used for each multi-dimensional or batched transform (0 for all cores);
+                   not used by the numpy backend
+    """
+
+    def __init__(self, name='scipy', workers=1):
+        self.name = name
+        self.workers = workers
+        self._kwargs = {'workers': workers or os.cpu_count() or 1}
+        if name == 'scipy':
+            self._module = scipy_fft
+        elif name == 'numpy':
+            self._module = np.fft
+            self._kwargs = {}
+        elif name == 'pyfftw':
+            try:
+                import pyfftw.interfaces.scipy_fft as module
+                from pyfftw.interfaces import cache
+            except ImportError:
+                raise ValueError('fft backend pyfftw requires pyfftw to be installed')
+            cache.enable()
+            self._module = module
+        else:
+            raise ValueError('Unknown fft backend: %s' % name)
+        self._dct_module = scipy_fft if name == 'numpy' else self._module
+
+    def rfft(self, x, n=None, axis=-1):
+        return self._module.rfft(x, n, axis=axis, **self._kwargs)
+
+    def irfft(self, x, n=None, axis=-1):
+        return self._module.irfft(x, n, axis=axis, **self._kwargs)
+
+    def rfftn(self, x, s=None, axes=None):
+        return self._module.rfftn(x, None if s is None else tuple(np.atleast_1d(s).tolist()), axes=axes,
+                                  **self._kwargs)
+
+    def irfftn(self, x, s=None, axes=None):
+        return self._module.irfftn(x, None if s is None else tuple(np.atleast_1d(s).tolist()), axes=axes,
+                                   **self._kwargs)
+
+    def dct(self, x, axis=-1, **kwargs):
+        return self._dct_module.dct(x, axis=axis, **self._kwargs, **kwargs)
+
+    def idct(self, x, axis=-1, **kwargs):
+        return self._dct_module.idct(x, axis=axis, **self._kwargs, **kwargs)
+
+
+# backend used for all FFTs and DCTs; set using setFFTBackend, or fft_backend and fft_workers in the getdist config file
+fft_backend = FFTBackend()
+
+
+def setFFTBackend(name='scipy', workers=1):
+    """
+    Set the backend used for all FFTs and DCTs.
+
+    :param name: 'scipy', 'numpy' or 'pyfftw' (if installed)
+    :param workers: number of threads for each transform (0 for all cores)
+    :return: the new :class:`FFTBackend`
+    """
+    global fft_backend
+    fft_backend = FFTBackend(name, workers)
+    return fft_backend
+
+
+class SpectrumCache:
+    """
+    Thread-safe least-recently-used cache of FFT spectra (or other arrays), e.g. keyed by content
+    (see :func:`spectrumKey`), holding at most max_bytes of arrays. Cached arrays are read-only.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        if value.nbytes > self.max_bytes:
+            return
+        value.flags.writeable = False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._items.popitem(last=False)[1].nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+def spectrumKey(arr, fsize, dtype=None):
+    """
+    Key for the FFT of arr zero-padded to size fsize (and optionally converted to dtype), using a hash of the
+    array content (so equal kernels or masks give the same key, and keys are never reused for different arrays)
+    """
+    arr = np.ascontiguousarray(arr)
+    return tuple(np.atleast_1d(fsize).tolist()), arr.shape, np.dtype(dtype or arr.dtype).str, hashlib.blake2b(
+        arr.data, digest_size=16).digest()
+
+
+# module-level cache of the spectra of data-independent arrays (kernels and prior masks),
+# shared between all densities, parameters and threads; set spectrum_cache.max_bytes to change the memory budget
+spectrum_cache = SpectrumCache(max_bytes=64 * 1024 ** 2)
+
+
+def _spectrum(arr, fsize, rfft, cache=None, shared=False, dtype=None):
+    if cache is not None:
+        # the array is kept with its spectrum, so its id cannot be reused by a different array while it is cached
+        key = (tuple(np.atleast_1d(fsize).tolist()), arr.shape, id(arr), dtype)
+        entry = cache.get(key)
+        if entry is not None and entry[0] is arr:
+            return entry[1]
+    if shared:
+        shared_key = spectrumKey(arr, fsize, dtype)
+        spectrum = spectrum_cache.get(shared_key)
+        if spectrum is None:
+            spectrum = rfft(arr if dtype is None else arr.astype(dtype, copy=False), fsize)
+            spectrum_cache[shared_key] = spectrum
+    else:
+        spectrum = rfft(arr if dtype is None else arr.astype(dtype, copy=False), fsize)
+    if cache is not None:
+        cache[key] = (arr, spectrum)
+    return spectrum
+
+
+def convolve1D(x, y, mode, largest_size=0, cache=None, cache_args=(1, 2), shared_args=()):
     if min(x.shape[0], y.shape[0]) > 1000:
-        return convolveFFT(x, y, mode, largest_size=largest_size, cache=cache, cache_args=cache_args)
+        return convolveFFT(x, y, mode, largest_size=largest_size, cache=cache, cache_args=cache_args,
+                           shared_args=shared_args)
     else:
         return np.convolve(x, y, mode)
 
 
-def convolve2D(x, y, mode, largest_size=0, cache=None, cache_args=(1, 2)):
-    return convolveFFTn(x, y, mode, largest_size, cache, cache_args=cache_args)
+def convolve1DRows(x, y, mode):
+    """
+    Convolve each row of x with the corresponding row of y, giving the same result as :func:`convolve1D` for each.
+    Short kernels are summed directly (so zero regions stay exactly zero), long ones using batched FFTs.
 
+    :param x: 2D array of data rows
+    :param y: 2D array of kernels, one for each row of x
+    :param mode: 'same', 'full' or 'valid'
+    :return: 2D array of convolved rows
+    """
+    return convolve1DRowsMulti(x, y[np.newaxis], mode)[0]
 
-# noinspection PyUnboundLocalVariable
-def convolveFFT(x, y, mode='same', yfft=None, xfft=None, largest_size=0, cache=None, cache_args=(1, 2)):
+
+def convolve1DRowsMulti(x, y, mode):
+    """
+    Convolve each row of x with the corresponding row of each of a stack of kernel arrays, as for
+    :func:`convolve1DRows` with each kernel array. The data are only padded (or forward-transformed) once,
+    and all the convolutions are summed (or inverse-transformed) together.
+
+    :param x: 2D array of data rows
+    :param y: 3D array of kernels, y[i] giving the kernels for each row of x
+    :param mode: 'same', 'full' or 'valid'
+    :return: 3D array of convolved rows, one 2D array for each kernel array
+    """
+    if x.shape[0] == 1:
+        return np.array([convolve1D(x[0], kernels[0], mode) for kernels in y])[:, np.newaxis, :]
+    n, m = x.shape[1], y.shape[2]
+    size = n + m - 1
+    if min(n, m) > 1000:
+        fsize = fastFFTSize(size)
+        res = fft_backend.irfft(fft_backend.rfft(x, fsize, axis=1) * fft_backend.rfft(y, fsize, axis=2), fsize,
+                                axis=2)[:, :, :size]
+    else:
+        padded = np.zeros((x.shape[0], n + 2 * (m - 1)))
+        padded[:, m - 1:m - 1 + n] = x
+        res = np.zeros((y.shape[0], x.shape[0], size))
+        for k in range(m):
+            res += y[:, :, m - 1 - k, np.newaxis] * padded[:, k:k + size]
+    if mode == 'same':
+        return res[:, :, (m - 1) // 2:(m - 1) // 2 + n]
+    elif mode == 'full':
+        return res
+    elif mode == 'valid':
+        return res[:, :, m - 1:n]
+
+
+def convolve2D(x, y, mode, largest_size=0, cache=None, cache_args=(1, 2), shared_args=(), dtype=None):
+    return convolveFFTn(x, y, mode, largest_size, cache, cache_args=cache_args, shared_args=shared_args,
+                        dtype=dtype)
+
+
+def lowRankFactors(win, max_rank=None, rtol=1e-12):
+    """
+    Factorize a 2D kernel as a sum of separable terms, win = sum_r outer(ky_r, kx_r), using the singular value
+    decomposition. Terms with singular values below rtol times the largest are dropped, so the factorization
+    is exact to rounding (e.g. one term for an uncorrelated Gaussian kernel).
+
+    :param win: 2D kernel
+    :param max_rank: maximum number of terms
+    :return: list of (ky, kx) pairs, or None if more than max_rank terms are needed
+    """
+    u, s, vt = np.linalg.svd(win)
+    rank = int(np.sum(s > rtol * s[0]))
+    if max_rank is not None and rank > max_rank:
+        return None
+    return [(u[:, r] * s[r], vt[r]) for r in range(rank)]
+
+
+def convolveLowRank(y, x, factors, mode='same'):
+    """
+    2D convolution of the separable array outer(y, x) with the kernel sum_r outer(ky_r, kx_r) (e.g. from
+    :func:`lowRankFactors`), calculated exactly from 1D convolutions along each axis and a matrix product.
+
+    :param y: 1D array along the first (y) axis
+    :param x: 1D array along the second (x) axis
+    :param factors: list of (ky, kx) pairs of 1D kernels of odd length
+    :param mode: 'same' or 'valid'
+    :return: 2D convolved array
+    """
+    cy = np.array([np.convolve(y, ky, mode) for ky, _ in factors])
+    cx = np.array([np.convolve(x, kx, mode) for _, kx in factors])
+    return np.dot(cy.T, cx)
+
+
+def convolveFFT(x, y, mode='same', yfft=None, xfft=None, largest_size=0, cache=None, cache_args=(1, 2),
+                shared_args=()):
     """
     convolution of x with y; ffts can be cached.
-    Be careful with caches, key uses id which can be reused for different object if object is freed.
+    Spectra of arguments in cache_args (1 for x, 2 for y) are stored in the cache dictionary if given, keyed by id
+    (and kept with the array, so the key cannot be reused while cached). Spectra of arguments in shared_args are
+    also stored in the module-level spectrum_cache keyed by content, e.g. for kernels and prior masks that are the
+    same for many densities.
     """
     size = x.size + y.size - 1
-    fsize = nearestFFTnumber(np.maximum(largest_size, size))
+    fsize = fastFFTSize(max(largest_size, size))
 
     if yfft is None:
-        if cache is not None and 2 in cache_args:
-            key = (fsize, y.size, id(y))
-            yfft = cache.get(key)
-        if yfft is None:
-            yfft = np.fft.rfft(y, fsize)
-            if cache is not None and 2 in cache_args:
-                cache[key] = yfft
+        yfft = _spectrum(y, fsize, fft_backend.rfft, cache if 2 in cache_args else None, 2 in shared_args)
     if xfft is None:
-        if cache is not None and 1 in cache_args:
-            key = (fsize, x.size, id(x))
-            xfft = cache.get(key)
-        if xfft is None:
-            xfft = np.fft.rfft(x, fsize)
-            if cache is not None and 1 in cache_args:
-                cache[key] = xfft
-    res = np.fft.irfft(xfft * yfft)[0:size]
+        xfft = _spectrum(x, fsize, fft_backend.rfft, cache if 1 in cache_args else None, 1 in shared_args)
+    res = fft_backend.irfft(xfft * yfft, fsize)[0:size]
     if mode == 'same':
         return res[(y.size - 1) // 2:(y.size - 1) // 2 + x.size]
     elif mode == 'full':
@@ -68,30 +299,24 @@ def convolveFFT(x, y, mode='same', yfft=None, xfft=None, largest_size=0, cache=N
         return res[y.size - 1:x.size]
 
 
-# noinspection PyUnboundLocalVariable
-def convolveFFTn(in1, in2, mode="same", largest_size=0, cache=None, yfft=None, xfft=None, cache_args=(1, 2)):
+def convolveFFTn(in1, in2, mode="same", largest_size=0, cache=None, yfft=None, xfft=None, cache_args=(1, 2),
+                 shared_args=(), dtype=None):
+    """
+    N-dimensional convolution of in1 with in2 using FFTs; ffts can be cached as for :func:`convolveFFT`.
+    If dtype is np.float32, the arrays are transformed in single precision (complex64 spectra with the scipy
+    and pyfftw backends), using half the memory and less time, and the result is float32.
+    """
     s1 = np.array(in1.shape)
     s2 = np.array(in2.shape)
     size = s1 + s2 - 1
-    fsize = nearestFFTnumber(np.maximum(largest_size, size))
-    if cache is not None:
-        if xfft is None and 1 in cache_args:
-            key = (tuple(fsize), tuple(in1.shape), id(in1))
-            xfft = cache.get(key)
-        if yfft is None and 2 in cache_args:
-            key2 = (tuple(fsize), tuple(in2.shape), id(in2))
-            yfft = cache.get(key2)
+    fsize = fastFFTSize(np.maximum(largest_size, size))
     if xfft is None:
-        xfft = np.fft.rfftn(in1, fsize)
-        if cache is not None and 1 in cache_args:
-            cache[key] = xfft
+        xfft = _spectrum(in1, fsize, fft_backend.rfftn, cache if 1 in cache_args else None, 1 in shared_args, dtype)
     if yfft is None:
-        yfft = np.fft.rfftn(in2, fsize)
-        if cache is not None and 2 in cache_args:
-            cache[key2] = yfft
+        yfft = _spectrum(in2, fsize, fft_backend.rfftn, cache if 2 in cache_args else None, 2 in shared_args, dtype)
 
     fslice = tuple([slice(0, int(sz)) for sz in size])
-    ret = np.fft.irfftn(xfft * yfft, fsize)[fslice]
+    ret = fft_backend.irfftn(xfft * yfft, fsize)[fslice]
 
     if mode == "full":
         return ret
@@ -101,6 +326,39 @@ def convolveFFTn(in1, in2, mode="same", largest_size=0, cache=None, yfft=None, x
         return _centered(ret, s1 - s2 + 1)
 
 
+def convolveFFTnMulti(in1, kernels, mode="same", largest_size=0, cache=None, shared_args=(), dtype=None):
+    """
+    N-dimensional convolutions of in1 with each of a set of kernels of the same shape, as for :func:`convolveFFTn`
+    with each kernel, but forward-transforming in1 once and doing one batched inverse transform.
+
+    :param in1: N-dimensional array
+    :param kernels: list of kernel arrays
+    :param mode: 'same', 'full' or 'valid'
+    :param largest_size: minimum transform size
+    :param cache: optional dictionary to cache the spectrum of in1 (keyed by id, as for :func:`convolveFFT`)
+    :param shared_args: include 1 (in1) or 2 (kernels) to store spectra in the module-level spectrum_cache
+    :param dtype: optional type for the transforms, e.g. np.float32 for single precision
+    :return: array of results stacked along the first axis
+    """
+    s1 = np.array(in1.shape)
+    s2 = np.array(kernels[0].shape)
+    size = s1 + s2 - 1
+    fsize = fastFFTSize(np.maximum(largest_size, size))
+    xfft = _spectrum(in1, fsize, fft_backend.rfftn, cache, 1 in shared_args, dtype)
+    yfft = np.array([_spectrum(kernel, fsize, fft_backend.rfftn, None, 2 in shared_args, dtype)
+                     for kernel in kernels])
+
+    fslice = (slice(None),) + tuple([slice(0, int(sz)) for sz in size])
+    ret = fft_backend.irfftn(xfft * yfft, fsize, axes=tuple(range(1, in1.ndim + 1)))[fslice]
+
+    if mode == "full":
+        return ret
+    elif mode == "same":
+        return _centered(ret, np.concatenate([[len(kernels)], s1]))
+    elif mode == "valid":
+        return _centered(ret, np.concatenate([[len(kernels)], s1 - s2 + 1]))
+
+
 def _centered(arr, newsize):
     # Return the center newsize portion of the array.
     startind = (np.array(arr.shape) - newsize) // 2
@@ -127,22 +385,32 @@ def autoConvolve(x, n=None, normalize=True):
     if normalize=True then normalize convolution by the number of terms for each k
     (can input x-mean(x) and divide result by variance to get auto correlation)
     """
-    s = nearestFFTnumber(2 * x.size)
-    #    yt = np.fft.rfft(x, s)
-    #    yt *= yt.conj()
-    #    return np.fft.irfft(yt)[0:x.size]
-    xt = fftpack.rfft(x, s)
-    auto = np.empty((xt.size // 2) + 1)
-    auto[0] = xt[0] ** 2
-    auto[-1] = xt[-1] ** 2
-    auto[1:-1] = (xt[1:-2:2] ** 2 + xt[2:-1:2] ** 2)
+    s = fastFFTSize(2 * x.size)
+    xt = fft_backend.rfft(x, s)
     n = n or x.size
-    res = fftpack.idct(auto, type=1)[0:n] / s
+    res = fft_backend.irfft(xt.real ** 2 + xt.imag ** 2, s)[0:n]
     if normalize:
         res /= np.arange(x.size, x.size - n, -1)
     return res
 
 
+def autoConvolveColumns(x, n=None, normalize=True):
+    """
+    Calculates auto-covariance of each column of 2D array x at once using batched FFTs,
+    result[k, j] = sum_i x_{i,j} x_{i+k,j}
+    n is maximum size to return (k = 0..n-1, at most the number of rows)
+    if normalize=True then normalize convolution by the number of terms for each k
+    """
+    size = x.shape[0]
+    s = fastFFTSize(2 * size)
+    xt = fft_backend.rfft(x, s, axis=0)
+    n = min(n or size, size)
+    res = fft_backend.irfft(xt.real ** 2 + xt.imag ** 2, s, axis=0)[0:n]
+    if normalize:
+        res /= np.arange(size, size - n, -1)[:, np.newaxis]
+    return res
+
+
 # noinspection PyUnboundLocalVariable
 def convolveGaussianDCT(x, sigma, pad_sigma=4, mode='same', cache=None):
     """
@@ -154,7 +422,7 @@ def convolveGaussianDCT(x, sigma, pad_sigma=4, mode='same', cache=None):
     fill = int(pad_sigma * sigma)
     actual_size = x.size + fill * 2
     if fill > 0:
-        s = nearestFFTnumber(actual_size)
+        s = fastFFTSize(actual_size)
         fill2 = s - x.size - fill
         padded_x = np.pad(x, (fill, fill2), mode='constant')
     else:
@@ -166,13 +434,13 @@ def convolveGaussianDCT(x, sigma, pad_sigma=4, mode='same', cache=None):
     if gauss is None:
         gauss = np.exp(-(np.arange(0, s) * (np.pi * hnorm)) ** 2 / 2.)
         cache[(s, hnorm)] = gauss
-    res = fftpack.idct(fftpack.dct(padded_x, overwrite_x=fill > 0) * gauss, overwrite_x=fill > 0) / (2 * s)
+    res = fft_backend.idct(fft_backend.dct(padded_x, overwrite_x=fill > 0) * gauss, overwrite_x=fill > 0)
     if fill == 0:
         return res
     elif mode == 'same':
-        return res[fill:-fill2]
+        return res[fill:fill + x.size]
     elif mode == 'valid':
-        return res[fill * 2:-fill2 - fill]
+        return res[fill * 2:x.size]
     else:
         raise ValueError('mode not supported for convolveGaussianDCT')
 
@@ -187,17 +455,17 @@ def convolveGaussian(x, sigma, sigma_range=4, cache=None):
     fill = int(sigma_range * sigma)
     actual_size = x.size + 2 * fill
     if fill > 0:
-        s = nearestFFTnumber(actual_size)
+        s = fastFFTSize(actual_size)
     else:
         s = actual_size
     gauss = None if cache is None else cache.get((fill, actual_size, sigma))
     if gauss is None:
         hnorm = sigma / float(s)
-        ps = np.arange(1, s + 1) // 2
+        ps = np.arange(s // 2 + 1)
         gauss = np.exp(-(ps * (np.pi * hnorm)) ** 2 * 2)
         if cache is not None:
             cache[(fill, actual_size, sigma)] = gauss
-    res = fftpack.irfft(fftpack.rfft(x, s) * gauss, s)
+    res = fft_backend.irfft(fft_backend.rfft(x, s) * gauss, s)
     return res[:x.size]
 
 
@@ -209,16 +477,16 @@ def convolveGaussianTrunc(x, sigma, sigma_range=4, mode='same', cache=None):
     """
     fill = int(sigma_range * sigma)
     actual_size = x.size + 2 * fill
-    s = nearestFFTnumber(actual_size)
+    s = fastFFTSize(actual_size)
     gauss = None if cache is None else cache.get((fill, actual_size, sigma))
     if gauss is None:
         points = np.arange(-fill, fill + 1)
         win = np.exp(-(points / sigma) ** 2 / 2.)
         win /= np.sum(win)
-        gauss = np.fft.rfft(win, s)
+        gauss = fft_backend.rfft(win, s)
         if cache is not None:
             cache[(fill, actual_size, sigma)] = gauss
-    res = np.fft.irfft(np.fft.rfft(x, s) * gauss, s)[:actual_size]
+    res = fft_backend.irfft(fft_backend.rfft(x, s) * gauss, s)[:actual_size]
     if mode == 'same':
         return res[fill:-fill]
     elif mode == 'full':
@@ -227,9 +495,14 @@ def convolveGaussianTrunc(x, sigma, sigma_range=4, mode='same', cache=None):
         return res[2 * fill:-2 * fill]
 
 
+def dct(a, axis=-1):
+    return fft_backend.dct(a, axis=axis)
+
+
 def dct2d(a):
-    return fftpack.dct(fftpack.dct(a, axis=0), axis=1)
+    return fft_backend.dct(fft_backend.dct(a, axis=0), axis=1)
 
 
 def idct2d(a):
-    return fftpack.idct(fftpack.idct(a, axis=1), axis=0)
+    # unnormalized, as the inverse of dct2d up to a factor 4 * a.size
+    return fft_backend.idct(fft_backend.idct(a, axis=1, norm='forward'), axis=0, norm='forward')
@@ -1,7 +1,6 @@
 import numpy as np
-from scipy import fftpack
 from scipy.optimize import fsolve, brentq, minimize
-from getdist.convolve import dct2d
+from getdist.convolve import dct, dct2d
 import logging
 import warnings
 
@@ -108,7 +107,7 @@ def gaussian_kde_bandwidth_binned(data, Neff, a=None):
     I = np.arange(1, data.size) ** 2
     logI = np.log(I)
     if a is None:
-        a = fftpack.dct(data / np.sum(data))
+        a = dct(data / np.sum(data))
     a2 = (a[1:] / 2) ** 2
     try:
         n_scaling = Neff ** (-1. / 5)
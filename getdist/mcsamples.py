@@ -5,21 +5,31 @@ import copy
 import pickle
 import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Mapping, Any, Optional, Union, Iterable
 import numpy as np
 from scipy.stats import norm
 import getdist
 from getdist import types as types
 from getdist import chains, covmat, ParamInfo, IniFile, ParamNames, cobaya_interface
+from getdist.paramnames import makeList
 from getdist.densities import Density1D, Density2D, DensityND
 from getdist.densities import getContourLevels as getImportContourLevels
 from getdist.chains import Chains, chainFiles, last_modified, WeightedSampleError, ParamError
-from getdist.convolve import convolve1D, convolve2D
+from getdist.convolve import convolve1D, convolve1DRows, convolve1DRowsMulti, convolve2D, convolveFFTnMulti, \
+    autoConvolveColumns, lowRankFactors, convolveLowRank, SpectrumCache
 from getdist.cobaya_interface import MCSamplesFromCobaya
 import getdist.kde_bandwidth as kde
 from getdist.parampriors import ParamBounds
 
-pickle_version = 22
+pickle_version = 27
+
+# maximum number of parameters binned and smoothed together when calculating many 1D densities
+batch1D_columns = 32
+
+# convolutions of prior masks with kernel moments for boundary corrections, which do not depend on the samples,
+# keyed by grid size, kernel and prior limits; set mask_moment_cache.max_bytes to change the memory budget
+mask_moment_cache = SpectrumCache(max_bytes=64 * 1024 ** 2)
 
 
 class MCSamplesError(WeightedSampleError):
@@ -120,6 +130,33 @@ class Kernel1D:
         self.Win = Win / np.sum(Win)
 
 
+class BinningPlan:
+    """
+    Cache of the parameter ranges used for densities, and of the fine-bin indices of the samples of each parameter
+    for each number of fine bins, so that the samples of a parameter are only binned once for any number of 1D
+    and 2D densities (e.g. for all the pairs in a triangle plot). Bin indices are stored as compact int16
+    (or int32) arrays.
+    """
+    range_attrs = ('param_min', 'param_max', 'range_min', 'range_max', 'sigma_range', 'has_limits_bot',
+                   'has_limits_top', 'has_limits')
+
+    def __init__(self):
+        self.ranges = {}
+        self.bins = {}
+
+    def copy(self):
+        new = BinningPlan()
+        new.ranges = dict(self.ranges)
+        new.bins = dict(self.bins)
+        return new
+
+    def discard(self, j):
+        self.ranges.pop(j, None)
+        for key in list(self.bins):
+            if key[0] == j:
+                self.bins.pop(key, None)
+
+
 # =============================================================================
 
 class MCSamples(Chains):
@@ -204,6 +241,8 @@ class MCSamples(Chains):
         self.contours = np.array([0.68, 0.95])
         self.max_scatter_points: int = 2000
         self.credible_interval_threshold: float = 0.05
+        self.num_threads: int = 1
+        self.single_precision_2D = False
 
         self.shade_likes_is_mean_loglikes = False
 
@@ -242,7 +281,9 @@ class MCSamples(Chains):
         self.converge_test_limit = 0.95
 
         self.done_1Dbins = False
+        self._marge1D_done = set()
         self.density1D = dict()
+        self._binning_plan = BinningPlan()
 
         self.updateSettings(ini=ini, settings=settings)
 
@@ -282,13 +323,25 @@ class MCSamples(Chains):
 
     def copy(self, label=None, settings=None):
         """
-        Create a copy of this sample object
+        Create a copy of this sample object.
+
+        The copy shares the samples, weights and loglikes arrays (and cached densities) with this instance
+        rather than duplicating them (copy-on-write): the copy's arrays are read-only views, and methods that
+        change the samples or weights of either instance make a private copy first. This instance's arrays stay
+        writable, but changing them directly in place also changes the copy; to change the values of the copy
+        directly, assign a new array (e.g. a copy) rather than modifying it in place.
 
         :param label: optional lable for the new copy
         :param settings: optional modified settings for the new copy
         :return: copyied :class:`MCSamples` instance
         """
-        new = copy.deepcopy(self)
+        memo = self._sharedArraysMemo()
+        for density in self.density1D.values():
+            memo[id(density)] = density
+        new = copy.deepcopy(self, memo)
+        new._shared_arrays = frozenset()
+        new._sort_cache = dict(self._sort_cache)
+        new._binning_plan = self._binning_plan.copy()
         if label:
             new.label = label
         if settings is not None:
@@ -296,6 +349,12 @@ class MCSamples(Chains):
             new.updateSettings(settings)
         return new
 
+    def __getstate__(self):
+        # binned sample indices are large and cheap to regenerate
+        state = super().__getstate__()
+        state['_binning_plan'] = BinningPlan()
+        return state
+
     def setRanges(self, ranges):
         """
         Sets the ranges parameters, e.g. hard priors on positivity etc.
@@ -382,6 +441,8 @@ class MCSamples(Chains):
 
         ini.setAttr('max_scatter_points', self)
         ini.setAttr('credible_interval_threshold', self)
+        ini.setAttr('num_threads', self, 1)
+        ini.setAttr('single_precision_2D', self, False)
 
         ini.setAttr('subplot_size_inch', self)
         ini.setAttr('subplot_size_inch2', self)
@@ -414,33 +475,31 @@ class MCSamples(Chains):
         self.batch_path = ini.string('batch_path', self.batch_path, allowEmpty=False)
 
     def _initLimits(self, ini=None):
-        bin_limits = ""
-        if ini:
-            bin_limits = ini.string('all_limits', '')
-
         self.markers = {}
-
         for par in self.paramNames.names:
-            if bin_limits:
-                line = bin_limits
-            else:
-                line = ''
-                if ini and 'limits[%s]' % par.name in ini.params:
-                    line = ini.string('limits[%s]' % par.name)
-            if line:
-                limits = line.split()
-                if len(limits) == 2:
-                    self.ranges.setRange(par.name, limits)
-
-            par.limmin = self.ranges.getLower(par.name)
-            par.limmax = self.ranges.getUpper(par.name)
-            par.has_limits_bot = par.limmin is not None
-            par.has_limits_top = par.limmax is not None
+            self._initParamLimits(par, ini)
 
-            if ini and 'marker[%s]' % par.name in ini.params:
-                line = ini.string('marker[%s]' % par.name)
-                if line:
-                    self.markers[par.name] = float(line)
+    def _initParamLimits(self, par, ini=None):
+        if ini and ini.string('all_limits', ''):
+            line = ini.string('all_limits', '')
+        else:
+            line = ''
+            if ini and 'limits[%s]' % par.name in ini.params:
+                line = ini.string('limits[%s]' % par.name)
+        if line:
+            limits = line.split()
+            if len(limits) == 2:
+                self.ranges.setRange(par.name, limits)
+
+        par.limmin = self.ranges.getLower(par.name)
+        par.limmax = self.ranges.getUpper(par.name)
+        par.has_limits_bot = par.limmin is not None
+        par.has_limits_top = par.limmax is not None
+
+        if ini and 'marker[%s]' % par.name in ini.params:
+            line = ini.string('marker[%s]' % par.name)
+            if line:
+                self.markers[par.name] = float(line)
 
     def updateSettings(self, settings: Optional[Mapping[str, Any]] = None,
                        ini: Union[None, str, IniFile] = None, doUpdate=True):
@@ -526,25 +585,59 @@ class MCSamples(Chains):
         :return: self
         """
         super().updateBaseStatistics()
+        self._setCov()
+        return self._resetDependentStatistics()
+
+    def _resetDependentStatistics(self):
+        """
+        Resets cached densities and limits, and recalculates likelihood statistics, given updated
+        means and covariance.
+        """
         mult_max = (self.mean_mult * self.numrows) / min(self.numrows // 2, 500)
         outliers = np.sum(self.weights > mult_max)
         if outliers != 0:
             logging.warning('outlier fraction %s ', float(outliers) / self.numrows)
 
         self.indep_thin = 0
-        self._setCov()
         self.done_1Dbins = False
+        self._marge1D_done = set()
         self.density1D = dict()
+        self._binning_plan = BinningPlan()
 
         self._initLimits(self.ini)
 
         for par in self.paramNames.names:
             par.N_eff_kde = None
 
-        # Get ND confidence region
-        self._setLikeStats()
+        # ND confidence region and likelihood statistics are calculated when first needed
+        self.likeStats = None
         return self
 
+    def _columnChanged(self, j):
+        super()._columnChanged(j)
+        self._binning_plan.discard(j)
+        if self.needs_update:
+            return
+        # only statistics depending on column j need updating
+        par = self.paramNames.names[j]
+        self._initParamLimits(par, self.ini)
+        par.N_eff_kde = None
+        self.density1D.pop(par.name, None)
+        self._marge1D_done.discard(par.name)
+        self.done_1Dbins = False
+        if self.likeStats is not None:
+            self._setParamLikeStats(j)
+
+    def _columnsDeleted(self, indices):
+        names = [self.paramNames.names[i].name for i in indices]
+        super()._columnsDeleted(indices)
+        self._binning_plan = BinningPlan()
+        for name in names:
+            self.density1D.pop(name, None)
+            self._marge1D_done.discard(name)
+        if self.likeStats is not None:
+            self.likeStats.names = self.paramNames.names
+
     def makeSingleSamples(self, filename="", single_thin=None, random_state=None):
         """
         Make file of unit weight samples by choosing samples
@@ -883,12 +976,13 @@ class MCSamples(Chains):
         lines = ''
         nparam = self.n
 
-        chainlist = self.getSeparateChains()
-        num_chains_used = len(chainlist)
+        # separate chain objects are only made for the tests that use them
+        chainlist = self.chains
+        if chainlist is None and (self.chain_offsets is None or 'CorrLengths' in what or 'RafteryLewis' in what):
+            chainlist = self.getSeparateChains()
+        num_chains_used = len(self.chain_offsets) - 1 if chainlist is None else len(chainlist)
         if num_chains_used > 1 and feedback:
             print('Number of chains used = ', num_chains_used)
-        for chain in chainlist:
-            chain.setDiffs()
         parForm = self.paramNames.parFormat()
         parNames = [parForm % self.parName(j) for j in range(nparam)]
         limits = np.array([1 - (1 - test_confidence) / 2, (1 - test_confidence) / 2])
@@ -921,18 +1015,12 @@ class MCSamples(Chains):
             lines += "param sqrt(var(chain mean)/mean(chain var))\n"
             lines += "\n"
 
-            between_chain_var = np.zeros(nparam)
-            in_chain_var = np.zeros(nparam)
-            for chain in chainlist:
-                between_chain_var += (chain.means - self.means) ** 2
-            between_chain_var /= (num_chains_used - 1)
+            # Get stats for individual chains - the variance of the y over the mean of the variances
+            chain_norms, chain_means, chain_vars = self.getChainStatistics(nparam, diagonal=True)
+            between_chain_var = np.sum((chain_means - self.means) ** 2, axis=0) / (num_chains_used - 1)
+            in_chain_var = chain_norms.dot(chain_vars) / self.norm
 
             for j in range(nparam):
-                # Get stats for individual chains - the variance of the y over the mean of the variances
-                for chain in chainlist:
-                    in_chain_var[j] += np.dot(chain.weights, chain.diffs[j] ** 2)
-
-                in_chain_var[j] /= self.norm
                 lines += parNames[j] + "%10.4f  %s\n" % (
                     math.sqrt(between_chain_var[j] / in_chain_var[j]), self.parLabel(j))
             lines += "\n"
@@ -940,7 +1028,7 @@ class MCSamples(Chains):
         nparamMC = self.paramNames.numNonDerived()
         if num_chains_used > 1 and nparamMC > 0 and 'GelmanRubin' in what:
 
-            D = self.getGelmanRubinEigenvalues(chainlist=chainlist)
+            D = self.getGelmanRubinEigenvalues()
             if D is not None:
                 self.GelmanRubin = np.max(D)
                 lines += "var(mean)/mean(var) for eigenvalues of covariance of y of orthonormalized parameters\n"
@@ -970,12 +1058,13 @@ class MCSamples(Chains):
                 frac_indices.append(self.getFractionIndices(self.weights, i + 2))
             for j in range(nparam):
                 split_tests = np.zeros((self.max_split_tests - 1, 2))
-                confids = self.confidence(self.samples[:, j], limits)
+                confids = self.confidence(j, limits)
                 for ix, frac in enumerate(frac_indices):
                     split_n = 2 + ix
-                    for f1, f2 in zip(frac[:-1], frac[1:]):
-                        split_tests[ix, :] += (self.confidence(self.samples[:, j], limits, start=f1,
-                                                               end=f2) - confids) ** 2
+                    # subsets re-use the sort order of the full parameter column
+                    queries = [(j, limits, f1, f2) for f1, f2 in zip(frac[:-1], frac[1:])]
+                    for split_confids in self.confidences(queries):
+                        split_tests[ix, :] += (split_confids - confids) ** 2
 
                     split_tests[ix, :] = np.sqrt(split_tests[ix, :] / split_n) / self.sddev[j]
                 for endb, typestr in enumerate(['upper', 'lower']):
@@ -1005,7 +1094,7 @@ class MCSamples(Chains):
                     try:
                         for j in range(nparamMC):
                             # Get binary chain depending on whether above or below confidence value
-                            confids = self.confidence(chain.samples[:, j], limits, weights=chain.weights)
+                            confids = chain.confidence(j, limits)
                             for endb in [0, 1]:
                                 u = confids[endb]
                                 while True:
@@ -1059,7 +1148,7 @@ class MCSamples(Chains):
 
                         # Get thin factor to have independent samples rather than Markov
                         hardest = max(hardest, 0)
-                        u = self.confidence(self.samples[:, hardest], (1 - test_confidence) / 2, hardestend == 0)
+                        u = self.confidence(hardest, (1 - test_confidence) / 2, hardestend == 0)
 
                         while True:
                             thin_ix = self.thin_indices(thin_fac[ix], chain.weights)
@@ -1149,11 +1238,9 @@ class MCSamples(Chains):
                         thin_ix = chain.thin_indices(autocorr_thin)
                         thin_rows = len(thin_ix)
                         maxoff = min(maxoff, thin_rows // autocorr_thin)
-                        for j in range(nparam):
-                            diff = chain.diffs[j][thin_ix]
-                            for off in range(1, maxoff + 1):
-                                corrs[off - 1][j] += np.dot(diff[off:], diff[:-off]) / (thin_rows - off) / \
-                                                     self.vars[j]
+                        # all parameters and step separations at once from FFTs of the thinned differences
+                        diffs = chain.samples[thin_ix, :nparam] - chain.getMeans()[:nparam]
+                        corrs[:maxoff] += autoConvolveColumns(diffs, maxoff + 1)[1:] / self.vars[:nparam]
                     corrs /= len(chainlist)
 
                     lines += parForm % ""
@@ -1344,8 +1431,18 @@ class MCSamples(Chains):
     def _initParamRanges(self, j, paramConfid=None):
         if isinstance(j, str):
             j = self.index[j]
-        paramVec = self.samples[:, j]
-        return self._initParam(self.paramNames.names[j], paramVec, self.means[j], self.sddev[j], paramConfid)
+        par = self.paramNames.names[j]
+        ranges = self._binning_plan.ranges.get(j)
+        if ranges is None:
+            self._initParam(par, self.samples[:, j], self.means[j], self.sddev[j],
+                            paramConfid or self.initParamConfidenceData(j))
+            self._binning_plan.ranges[j] = {attr: getattr(par, attr) for attr in BinningPlan.range_attrs}
+        else:
+            par.err = self.sddev[j]
+            par.mean = self.means[j]
+            for attr, value in ranges.items():
+                setattr(par, attr, value)
+        return par
 
     def _initParam(self, par, paramVec, mean=None, sddev=None, paramConfid=None):
         if mean is None:
@@ -1374,7 +1471,7 @@ class MCSamples(Chains):
             par.sigma_range = scale
         else:
             par.sigma_range = min(par.err, scale)
-        if self.range_ND_contour >= 0 and self.likeStats:
+        if self.range_ND_contour >= 0 and self.loglikes is not None and self.getLikeStats():
             if self.range_ND_contour >= par.ND_limit_bot.size:
                 raise SettingError("range_ND_contour should be -1 (off), or an index into the computed contour levels")
             par.range_min = min(max(par.range_min - par.err, par.ND_limit_bot[self.range_ND_contour]), par.range_min)
@@ -1405,7 +1502,8 @@ class MCSamples(Chains):
 
         return par
 
-    def _binSamples(self, paramVec, par, num_fine_bins, borderfrac=0.1):
+    @staticmethod
+    def _binRange(par, num_fine_bins, borderfrac=0.1):
 
         # High resolution density (sampled many times per smoothing scale). First and last bins are half width
 
@@ -1417,9 +1515,26 @@ class MCSamples(Chains):
         if not par.has_limits_top:
             binmax += border
         fine_width = (binmax - binmin) / (num_fine_bins - 1)
+        return fine_width, binmin, binmax
+
+    def _binSamples(self, paramVec, par, num_fine_bins, borderfrac=0.1):
+        fine_width, binmin, binmax = self._binRange(par, num_fine_bins, borderfrac)
         ix = ((paramVec - binmin) / fine_width + 0.5).astype(int)
         return ix, fine_width, binmin, binmax
 
+    def _getBinIndices(self, j, par, num_fine_bins):
+        """
+        Get the fine-bin indices of the samples of parameter j (with ranges already set by _initParamRanges),
+        caching them in the binning plan.
+        """
+        key = (j, num_fine_bins)
+        binning = self._binning_plan.bins.get(key)
+        if binning is None:
+            ix, fine_width, binmin, binmax = self._binSamples(self.samples[:, j], par, num_fine_bins)
+            ix = ix.astype(np.int16 if num_fine_bins <= np.iinfo(np.int16).max else np.int32)
+            binning = self._binning_plan.bins[key] = (ix, fine_width, binmin, binmax)
+        return binning
+
     def get1DDensity(self, name, **kwargs):
         """
         Returns a :class:`~.densities.Density1D` instance for parameter with given name. Result is cached.
@@ -1461,164 +1576,260 @@ class MCSamples(Chains):
         if j is None:
             return None
 
-        par = self._initParamRanges(j, paramConfid)
+        return self._get1DDensities([j], [paramConfid], meanlikes, **kwargs)[0]
+
+    def get1DDensities(self, params=None, meanlikes=False, **kwargs):
+        """
+        Get :class:`~.densities.Density1D` instances for the marginalized 1D densities of many parameters at once.
+        Results are the same as for :meth:`get1DDensityGridData`, but the samples are binned for blocks of parameters
+        together and the smoothing and corrections applied to all the histograms with the same kernel size at once.
+        Results are cached as for :meth:`get1DDensity` (if no kwargs are given).
+
+        :param params: list of parameter names or indices, default all parameters
+        :param meanlikes: include mean likelihoods
+        :param kwargs: optional settings to override instance settings, as for :meth:`get1DDensityGridData`
+        :return: list of :class:`~.densities.Density1D` instances
+        """
+        if self.needs_update:
+            self.updateBaseStatistics()
+        indices = self._parameterIndices(params)
+        densities = []
+        for i in range(0, len(indices), batch1D_columns):
+            densities += self._get1DDensities(indices[i:i + batch1D_columns], meanlikes=meanlikes, **kwargs)
+        return densities
+
+    def _binColumns(self, indices, pars, binning, fine_bins):
+        """
+        Get the flattened fine-bin indices of a set of parameters, binning all the columns that are not already
+        in the binning plan in one pass over the samples
+        """
+        planned = [(j, fine_bins) in self._binning_plan.bins for j in indices]
+        columns = [i for i, is_planned in enumerate(planned) if not is_planned]
+        bin_indices = np.empty((self.numrows, len(indices)), dtype=int)
+        if columns:
+            binmin = np.array([binning[i][1] for i in columns])
+            fine_width = np.array([binning[i][0] for i in columns])
+            bin_indices[:, columns] = ((self.samples[:, [indices[i] for i in columns]] - binmin)
+                                       / fine_width + 0.5).astype(int)
+        for i, is_planned in enumerate(planned):
+            if is_planned:
+                bin_indices[:, i] = self._getBinIndices(indices[i], pars[i], fine_bins)[0]
+        bin_indices += np.arange(len(indices)) * fine_bins
+        return bin_indices.ravel()
+
+    # noinspection PyUnboundLocalVariable
+    def _get1DDensities(self, indices, paramConfids=None, meanlikes=False, **kwargs):
         num_bins = kwargs.get('num_bins', self.num_bins)
         smooth_scale_1D = kwargs.get('smooth_scale_1D', self.smooth_scale_1D)
         boundary_correction_order = kwargs.get('boundary_correction_order', self.boundary_correction_order)
         mult_bias_correction_order = kwargs.get('mult_bias_correction_order', self.mult_bias_correction_order)
         fine_bins = kwargs.get('fine_bins', self.fine_bins)
 
-        paramrange = par.range_max - par.range_min
-        if paramrange <= 0:
-            raise MCSamplesError('Parameter range is <= 0: ' + par.name)
-        width = paramrange / (num_bins - 1)
+        pars = []
+        binning = []
+        for j, paramConfid in zip(indices, paramConfids or [None] * len(indices)):
+            par = self._initParamRanges(j, paramConfid)
+            if par.range_max - par.range_min <= 0:
+                raise MCSamplesError('Parameter range is <= 0: ' + par.name)
+            pars.append(par)
+            binning.append(self._binRange(par, fine_bins))
 
-        bin_indices, fine_width, binmin, binmax = self._binSamples(self.samples[:, j], par, fine_bins)
-        bins = np.bincount(bin_indices, weights=self.weights, minlength=fine_bins)
+        bin_indices = self._binColumns(indices, pars, binning, fine_bins)
+        shape = (len(indices), fine_bins)
+        bins = np.bincount(bin_indices, weights=np.broadcast_to(self.weights[:, np.newaxis], (
+            self.numrows, len(indices))).ravel(), minlength=shape[0] * shape[1]).reshape(shape)
 
         if meanlikes:
             if self.shade_likes_is_mean_loglikes:
                 w = self.weights * self.loglikes
             else:
                 w = self.weights * np.exp((self.mean_loglike - self.loglikes))
-            finebinlikes = np.bincount(bin_indices, weights=w, minlength=fine_bins)
-
-        if smooth_scale_1D <= 0:
-            # Set automatically.
-            bandwidth = self.getAutoBandwidth1D(bins, par, j, mult_bias_correction_order,
-                                                boundary_correction_order) * (binmax - binmin)
-            # for low sample numbers with big tails (e.g. from nested), prevent making too wide
-            bandwidth = min(bandwidth, paramrange / 4)
-            smooth_1D = bandwidth * abs(smooth_scale_1D) / fine_width
-
-        elif smooth_scale_1D < 1.0:
-            smooth_1D = smooth_scale_1D * par.err / fine_width
-        else:
-            smooth_1D = smooth_scale_1D * width / fine_width
-
-        if smooth_1D < 2:
-            logging.warning('fine_bins not large enough to well sample smoothing scale - ' + par.name)
-
-        smooth_1D = min(max(1., smooth_1D), fine_bins // 2)
-
-        logging.debug("%s 1D sigma_range, std: %s, %s; smooth_1D_bins: %s ", par.name, par.sigma_range, par.err,
-                      smooth_1D)
-
-        winw = min(int(round(2.5 * smooth_1D)), fine_bins // 2 - 2)
-        kernel = Kernel1D(winw, smooth_1D)
-
-        cache = {}
-        conv = convolve1D(bins, kernel.Win, 'same', cache=cache)
-        fine_x = np.linspace(binmin, binmax, fine_bins)
-        density1D = Density1D(fine_x, P=conv, view_ranges=[par.range_min, par.range_max])
-
-        if meanlikes:
-            rawbins = conv.copy()
+            finebinlikes = np.bincount(bin_indices, weights=np.broadcast_to(w[:, np.newaxis], (
+                self.numrows, len(indices))).ravel(), minlength=shape[0] * shape[1]).reshape(shape)
+
+        smooths = np.empty(len(indices))
+        for i, (j, par, (fine_width, binmin, binmax)) in enumerate(zip(indices, pars, binning)):
+            paramrange = par.range_max - par.range_min
+            if smooth_scale_1D <= 0:
+                # Set automatically.
+                bandwidth = self.getAutoBandwidth1D(bins[i], par, j, mult_bias_correction_order,
+                                                    boundary_correction_order) * (binmax - binmin)
+                # for low sample numbers with big tails (e.g. from nested), prevent making too wide
+                bandwidth = min(bandwidth, paramrange / 4)
+                smooth_1D = bandwidth * abs(smooth_scale_1D) / fine_width
+
+            elif smooth_scale_1D < 1.0:
+                smooth_1D = smooth_scale_1D * par.err / fine_width
+            else:
+                width = paramrange / (num_bins - 1)
+                smooth_1D = smooth_scale_1D * width / fine_width
+
+            if smooth_1D < 2:
+                logging.warning('fine_bins not large enough to well sample smoothing scale - ' + par.name)
+
+            smooths[i] = min(max(1., smooth_1D), fine_bins // 2)
+
+            logging.debug("%s 1D sigma_range, std: %s, %s; smooth_1D_bins: %s ", par.name, par.sigma_range,
+                          par.err, smooths[i])
+
+        winws = np.minimum(np.round(2.5 * smooths).astype(int), fine_bins // 2 - 2)
+        P = np.empty(shape)
+        rawbins = np.empty(shape)
+        kernels = [None] * len(indices)
+        for winw in np.unique(winws):
+            # smooth all the histograms that use the same kernel size together
+            rows = np.nonzero(winws == winw)[0]
+            for i in rows:
+                kernels[i] = Kernel1D(winw, smooths[i])
+            P[rows], rawbins[rows] = self._smooth1DBins(
+                bins[rows], [kernels[i] for i in rows], np.array([pars[i].has_limits_bot for i in rows]),
+                np.array([pars[i].has_limits_top for i in rows]), boundary_correction_order,
+                mult_bias_correction_order)
+
+        densities = []
+        for i, (par, (fine_width, binmin, binmax)) in enumerate(zip(pars, binning)):
+            fine_x = np.linspace(binmin, binmax, fine_bins)
+            density1D = Density1D(fine_x, P=P[i], view_ranges=[par.range_min, par.range_max])
+            density1D.normalize('max', in_place=True)
+            if not kwargs:
+                self.density1D[par.name] = density1D
 
-        if par.has_limits and boundary_correction_order >= 0:
+            if meanlikes:
+                ix = density1D.P > 0
+                finebinlikes[i, ix] /= density1D.P[ix]
+                binlikes = convolve1D(finebinlikes[i], kernels[i].Win, 'same')
+                binlikes[ix] *= density1D.P[ix] / rawbins[i, ix]
+                if self.shade_likes_is_mean_loglikes:
+                    maxbin = np.min(binlikes)
+                    binlikes = np.where((binlikes - maxbin) < 30, np.exp(-(binlikes - maxbin)), 0)
+                    binlikes[rawbins[i] == 0] = 0
+                binlikes /= np.max(binlikes)
+                density1D.likes = binlikes
+            else:
+                density1D.likes = None
+            densities.append(density1D)
+
+        return densities
+
+    @staticmethod
+    def _smooth1DBins(bins, kernels, has_limits_bot, has_limits_top, boundary_correction_order,
+                      mult_bias_correction_order):
+        """
+        Smooth a set of histograms with kernels of the same size, applying boundary and multiplicative bias
+        corrections.
+
+        :param bins: 2D array of histograms
+        :param kernels: list of :class:`Kernel1D` for each histogram (with the same winw)
+        :param has_limits_bot: boolean array, whether each parameter has a lower prior limit
+        :param has_limits_top: boolean array, whether each parameter has an upper prior limit
+        :param boundary_correction_order: see :meth:`get1DDensityGridData`
+        :param mult_bias_correction_order: see :meth:`get1DDensityGridData`
+        :return: smoothed densities (unnormalized), and the smoothed histograms before corrections
+        """
+        winw = kernels[0].winw
+        x = kernels[0].x
+        Win = np.array([kernel.Win for kernel in kernels])
+        fine_bins = bins.shape[1]
+        conv = convolve1DRows(bins, Win, 'same')
+        P = conv.copy()
+
+        has_limits = has_limits_bot | has_limits_top
+        if boundary_correction_order >= 0 and np.any(has_limits):
             # correct for cuts allowing for normalization over window
-            prior_mask = np.ones(fine_bins + 2 * winw)
-            if par.has_limits_bot:
-                prior_mask[winw] = 0.5
-                prior_mask[: winw] = 0
-            if par.has_limits_top:
-                prior_mask[-(winw + 1)] = 0.5
-                prior_mask[-winw:] = 0
-            a0 = convolve1D(prior_mask, kernel.Win, 'valid', cache=cache)
-            ix = np.nonzero(a0 * density1D.P)
-            a0 = a0[ix]
-            normed = density1D.P[ix] / a0
-            if boundary_correction_order == 0:
-                density1D.P[ix] = normed
-            elif boundary_correction_order <= 2:
-                # linear boundary kernel, e.g. Jones 1993, Jones and Foster 1996
-                # www3.stat.sinica.edu.tw/statistica/oldpdf/A6n414.pdf after Eq 1b, expressed for general prior mask
-                # cf arXiv:1411.5528
-                xWin = kernel.Win * kernel.x
-                a1 = convolve1D(prior_mask, xWin, 'valid', cache=cache)[ix]
-                a2 = convolve1D(prior_mask, xWin * kernel.x, 'valid', cache=cache, cache_args=[1])[ix]
-                xP = convolve1D(bins, xWin, 'same', cache=cache)[ix]
-                if boundary_correction_order == 1:
-                    corrected = (density1D.P[ix] * a2 - xP * a1) / (a0 * a2 - a1 ** 2)
+            rows = np.nonzero(has_limits)[0]
+            prior_mask = np.ones((rows.size, fine_bins + 2 * winw))
+            bot = has_limits_bot[rows]
+            prior_mask[bot, winw] = 0.5
+            prior_mask[bot, :winw] = 0
+            top = has_limits_top[rows]
+            prior_mask[top, -(winw + 1)] = 0.5
+            prior_mask[top, fine_bins + winw:] = 0
+            lim_Win = Win[rows]
+            lim_P = P[rows]
+            # convolutions of the mask with all the kernel moments x^n Win needed, calculated together
+            moments = 2 * boundary_correction_order + 1 if 0 <= boundary_correction_order <= 2 else 1
+            a = _cachedMaskMoments(
+                [('bounds', fine_bins, winw, kernels[row].h, has_limits_bot[row], has_limits_top[row], moments)
+                 for row in rows],
+                lambda i: convolve1DRowsMulti(prior_mask[i], np.array([lim_Win[i] * x ** n for n in range(moments)]),
+                                              'valid'))
+            a0 = a[0]
+            ix = a0 * lim_P != 0
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                normed = lim_P / a0
+                if boundary_correction_order == 0:
+                    corrected_P = normed
+                elif boundary_correction_order <= 2:
+                    # linear boundary kernel, e.g. Jones 1993, Jones and Foster 1996
+                    # www3.stat.sinica.edu.tw/statistica/oldpdf/A6n414.pdf after Eq 1b, expressed for general prior
+                    # mask, cf arXiv:1411.5528
+                    a1, a2 = a[1], a[2]
+                    xP = convolve1DRowsMulti(bins[rows], np.array(
+                        [lim_Win * x ** n for n in range(1, boundary_correction_order + 1)]), 'same')
+                    if boundary_correction_order == 1:
+                        corrected = (lim_P * a2 - xP[0] * a1) / (a0 * a2 - a1 ** 2)
+                    else:
+                        # quadratic correction
+                        a3, a4 = a[3], a[4]
+                        xP, x2P = xP
+                        denom = a4 * a2 * a0 - a4 * a1 ** 2 - a2 ** 3 - a3 ** 2 * a0 + 2 * a1 * a2 * a3
+                        A = a4 * a2 - a3 ** 2
+                        B = a2 * a3 - a4 * a1
+                        C = a3 * a1 - a2 ** 2
+                        corrected = (lim_P * A + xP * B + x2P * C) / denom
+                    corrected_P = normed * np.exp(np.minimum(corrected / normed, 4) - 1)
                 else:
-                    # quadratic correction
-                    a3 = convolve1D(prior_mask, xWin * kernel.x ** 2, 'valid', cache=cache, cache_args=[1])[ix]
-                    a4 = convolve1D(prior_mask, xWin * kernel.x ** 3, 'valid', cache=cache, cache_args=[1])[ix]
-                    x2P = convolve1D(bins, xWin * kernel.x, 'same', cache=cache, cache_args=[1])[ix]
-                    denom = a4 * a2 * a0 - a4 * a1 ** 2 - a2 ** 3 - a3 ** 2 * a0 + 2 * a1 * a2 * a3
-                    A = a4 * a2 - a3 ** 2
-                    B = a2 * a3 - a4 * a1
-                    C = a3 * a1 - a2 ** 2
-                    corrected = (density1D.P[ix] * A + xP * B + x2P * C) / denom
-                density1D.P[ix] = normed * np.exp(np.minimum(corrected / normed, 4) - 1)
-            else:
-                raise SettingError('Unknown boundary_correction_order (expected 0, 1, 2)')
-        elif boundary_correction_order == 2:
+                    raise SettingError('Unknown boundary_correction_order (expected 0, 1, 2)')
+            P[rows] = np.where(ix, corrected_P, lim_P)
+        if boundary_correction_order == 2 and not np.all(has_limits):
             # higher order kernel
             # eg. see http://www.jstor.org/stable/2965571
-            xWin2 = kernel.Win * kernel.x ** 2
-            x2P = convolve1D(bins, xWin2, 'same', cache=cache)
-            a2 = np.sum(xWin2)
-            a4 = np.dot(xWin2, kernel.x ** 2)
-            corrected = (density1D.P * a4 - a2 * x2P) / (a4 - a2 ** 2)
-            ix = density1D.P > 0
-            density1D.P[ix] *= np.exp(np.minimum(corrected[ix] / density1D.P[ix], 2) - 1)
+            rows = np.nonzero(~has_limits)[0]
+            xWin2 = Win[rows] * x ** 2
+            x2P = convolve1DRows(bins[rows], xWin2, 'same')
+            a2 = np.sum(xWin2, axis=1)[:, np.newaxis]
+            a4 = np.array([np.dot(row, x ** 2) for row in xWin2])[:, np.newaxis]
+            free_P = P[rows]
+            corrected = (free_P * a4 - a2 * x2P) / (a4 - a2 ** 2)
+            ix = free_P > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                P[rows] = np.where(ix, free_P * np.exp(np.minimum(corrected / free_P, 2) - 1), free_P)
 
         if mult_bias_correction_order:
-            prior_mask = np.ones(fine_bins)
-            if par.has_limits_bot:
-                prior_mask[0] *= 0.5
-            if par.has_limits_top:
-                prior_mask[-1] *= 0.5
-            a0 = convolve1D(prior_mask, kernel.Win, 'same', cache=cache, cache_args=[2])
+            prior_mask = np.ones(bins.shape)
+            prior_mask[has_limits_bot, 0] *= 0.5
+            prior_mask[has_limits_top, -1] *= 0.5
+            a0 = _cachedMaskMoments(
+                [('mult', fine_bins, winw, kernel.h, bot, top) for kernel, bot, top in
+                 zip(kernels, has_limits_bot, has_limits_top)],
+                lambda i: convolve1DRowsMulti(prior_mask[i], Win[np.newaxis, i], 'same'))[0]
             for _ in range(mult_bias_correction_order):
                 # estimate using flattened samples to remove second order biases
                 # mostly good performance, see http://www.jstor.org/stable/2965571 method 3,1 for first order
-                prob1 = density1D.P.copy()
+                prob1 = P.copy()
                 prob1[prob1 == 0] = 1
                 fine = bins / prob1
-                conv = convolve1D(fine, kernel.Win, 'same', cache=cache, cache_args=[2])
-                density1D.setP(density1D.P * conv)
-                density1D.P /= a0
+                P = P * convolve1DRows(fine, Win, 'same')
+                P /= a0
 
-        density1D.normalize('max', in_place=True)
-        if not kwargs:
-            self.density1D[par.name] = density1D
+        return P, conv
 
-        if meanlikes:
-            ix = density1D.P > 0
-            finebinlikes[ix] /= density1D.P[ix]
-            binlikes = convolve1D(finebinlikes, kernel.Win, 'same', cache=cache, cache_args=[2])
-            binlikes[ix] *= density1D.P[ix] / rawbins[ix]
-            if self.shade_likes_is_mean_loglikes:
-                maxbin = np.min(binlikes)
-                binlikes = np.where((binlikes - maxbin) < 30, np.exp(-(binlikes - maxbin)), 0)
-                binlikes[rawbins == 0] = 0
-            binlikes /= np.max(binlikes)
-            density1D.likes = binlikes
-        else:
-            density1D.likes = None
-
-        return density1D
-
-    def _setEdgeMask2D(self, parx, pary, prior_mask, winw, alledge=False):
-        if parx.has_limits_bot:
-            prior_mask[:, winw] /= 2
-            prior_mask[:, :winw] = 0
-        if parx.has_limits_top:
-            prior_mask[:, -(winw + 1)] /= 2
-            prior_mask[:, -winw:] = 0
-        if pary.has_limits_bot:
-            prior_mask[winw, :] /= 2
-            prior_mask[:winw:] = 0
-        if pary.has_limits_top:
-            prior_mask[-(winw + 1), :] /= 2
-            prior_mask[-winw:, :] = 0
-        if alledge:
-            prior_mask[:, :winw] = 0
-            prior_mask[:, -winw:] = 0
-            prior_mask[:winw:] = 0
-            prior_mask[-winw:, :] = 0
+    def _getEdgeMasks2D(self, parx, pary, xsize, ysize, winw, alledge=False):
+        # 1D prior masks along y and x (of the grids padded by winw); the 2D mask is their outer product
+        masks = []
+        for par, size in [(pary, ysize), (parx, xsize)]:
+            mask = np.ones(size + 2 * winw)
+            if par.has_limits_bot:
+                mask[winw] /= 2
+                mask[:winw] = 0
+            if par.has_limits_top:
+                mask[-(winw + 1)] /= 2
+                mask[-winw:] = 0
+            if alledge:
+                mask[:winw] = 0
+                mask[-winw:] = 0
+            masks.append(mask)
+        return masks
 
     def _getScaleForParam(self, par):
         # Also ensures that the 1D limits are initialized
@@ -1631,12 +1842,50 @@ class MCSamples(Chains):
         return scale
 
     def _make2Dhist(self, ixs, iys, xsize, ysize):
-        flatix = ixs + iys * xsize
+        # bin indices may be compact integer types
+        flatix = iys.astype(np.intp)
+        flatix *= xsize
+        flatix += ixs
         # note arrays are indexed y,x
 
         return np.bincount(flatix, weights=self.weights,
                            minlength=xsize * ysize).reshape((ysize, xsize)), flatix
 
+    def get2DDensities(self, pairs, num_plot_contours=None, get_density=False, meanlikes=False, max_workers=None,
+                       **kwargs):
+        """
+        Get 2D marginalized densities for many pairs of parameters at once, e.g. all those needed for a triangle plot.
+        The pairs are independent, so they are calculated concurrently in a pool of threads sharing the samples
+        (the binning and FFTs release the GIL). Parameter ranges and other statistics shared between pairs are
+        calculated first.
+
+        :param pairs: list of [x, y] parameter name or index pairs
+        :param num_plot_contours: number of contours to calculate and return in density.contours
+        :param get_density: only get the 2D marginalized densities, don't calculate confidence level members
+        :param meanlikes: calculate mean likelihoods as well as marginalized densities
+        :param max_workers: maximum number of threads to use (default: num_threads setting, 0 for all cores)
+        :param kwargs: optional settings to override instance settings, as for :meth:`get2DDensityGridData`
+        :return: list of :class:`~.densities.Density2D` instances (None for any unknown parameters)
+        """
+        if self.needs_update:
+            self.updateBaseStatistics()
+
+        def get_density2D(pair):
+            return self.get2DDensityGridData(pair[0], pair[1], num_plot_contours=num_plot_contours,
+                                             get_density=get_density, meanlikes=meanlikes, **kwargs)
+
+        num_threads = self.num_threads if max_workers is None else max_workers
+        if num_threads == 1 or len(pairs) < 2:
+            return [get_density2D(pair) for pair in pairs]
+        self.getCorrelationMatrix()
+        auto_bandwidth = kwargs.get('smooth_scale_2D', self.smooth_scale_2D) < 0
+        for j in {self._parAndNumber(j)[0] for pair in pairs for j in pair} - {None}:
+            par = self._initParamRanges(j)
+            if auto_bandwidth and not self.use_effective_samples_2D:
+                self._get1DNeff(par, j)
+        with ThreadPoolExecutor(num_threads or None) as executor:
+            return list(executor.map(get_density2D, pairs))
+
     def get2DDensity(self, x, y, normalized=False, **kwargs):
         """
         Returns a :class:`~.densities.Density2D` instance with marginalized 2D density.
@@ -1671,6 +1920,7 @@ class MCSamples(Chains):
             - **boundary_correction_order**
             - **mult_bias_correction_order**
             - **smooth_scale_2D**
+            - **single_precision_2D**
         :return: a :class:`~.densities.Density2D` instance
         """
         if self.needs_update:
@@ -1688,6 +1938,9 @@ class MCSamples(Chains):
         boundary_correction_order = kwargs.get('boundary_correction_order', self.boundary_correction_order)
         mult_bias_correction_order = kwargs.get('mult_bias_correction_order', self.mult_bias_correction_order)
         smooth_scale_2D = float(kwargs.get('smooth_scale_2D', self.smooth_scale_2D))
+        # smooth the density in single precision if requested (mean likelihoods, which are divided by smoothed
+        # values, and the contours are still calculated in double precision)
+        fft_dtype = np.float32 if kwargs.get('single_precision_2D', self.single_precision_2D) else None
 
         has_prior = parx.has_limits or pary.has_limits
 
@@ -1716,8 +1969,8 @@ class MCSamples(Chains):
             if base_fine_bins_2D < scaled and int(1 / angle_scale) > 1:
                 fine_bins_2D = scaled
 
-        ixs, finewidthx, xbinmin, xbinmax = self._binSamples(self.samples[:, j], parx, fine_bins_2D)
-        iys, finewidthy, ybinmin, ybinmax = self._binSamples(self.samples[:, j2], pary, fine_bins_2D)
+        ixs, finewidthx, xbinmin, xbinmax = self._getBinIndices(j, parx, fine_bins_2D)
+        iys, finewidthy, ybinmin, ybinmax = self._getBinIndices(j2, pary, fine_bins_2D)
 
         xsize = fine_bins_2D
         ysize = fine_bins_2D
@@ -1762,14 +2015,26 @@ class MCSamples(Chains):
         start = time.time()
         cache = {}
         convolvesize = xsize + 2 * winw + Win.shape[0]
-        bins2D = convolve2D(histbins, Win, 'same', largest_size=convolvesize, cache=cache)
+        indexes = np.arange(-winw, winw + 1)
+        if has_prior and boundary_correction_order == 1:
+            # convolve with the kernel and its x and y moments (for the linear boundary correction) together
+            winx = Win * indexes
+            winy = Win * indexes[:, np.newaxis]
+            bins2D, xP, yP = convolveFFTnMulti(histbins, [Win, winx, winy], 'same', largest_size=convolvesize,
+                                               cache=cache, shared_args=[2], dtype=fft_dtype)
+            bins2D = bins2D.copy()
+        else:
+            bins2D = convolve2D(histbins, Win, 'same', largest_size=convolvesize, cache=cache, shared_args=[2],
+                                dtype=fft_dtype)
 
         if meanlikes:
-            bin2Dlikes = convolve2D(finebinlikes, Win, 'same', largest_size=convolvesize, cache=cache, cache_args=[2])
+            bin2Dlikes = convolve2D(finebinlikes, Win, 'same', largest_size=convolvesize, cache=cache, cache_args=[2],
+                                    shared_args=[2])
             if mult_bias_correction_order:
                 ix = bin2Dlikes > 0
                 finebinlikes[ix] /= bin2Dlikes[ix]
-                likes2 = convolve2D(finebinlikes, Win, 'same', largest_size=convolvesize, cache=cache, cache_args=[2])
+                likes2 = convolve2D(finebinlikes, Win, 'same', largest_size=convolvesize, cache=cache,
+                                    cache_args=[2], shared_args=[2])
                 likes2[ix] *= bin2Dlikes[ix]
                 bin2Dlikes = likes2
             del finebinlikes
@@ -1779,32 +2044,39 @@ class MCSamples(Chains):
         else:
             bin2Dlikes = None
 
+        if has_prior or mult_bias_correction_order:
+            # The prior masks are separable, and the kernel (with its moments) separable or low rank, so
+            # convolutions of the masks are calculated exactly from 1D convolutions along each axis
+            factors = lowRankFactors(Win)
+
+            def mask_moment(alledge=False, px=0, py=0):
+                # convolution of the prior mask with the kernel moment Win * x^px * y^py
+                key = ('2D', xsize, ysize, winw, rx, ry, corr, parx.has_limits_bot, parx.has_limits_top,
+                       pary.has_limits_bot, pary.has_limits_top, alledge, px, py)
+                moment = mask_moment_cache.get(key)
+                if moment is None:
+                    masks = self._getEdgeMasks2D(parx, pary, xsize, ysize, winw, alledge)
+                    moment = convolveLowRank(masks[0], masks[1],
+                                             [(ky * indexes ** py, kx * indexes ** px) for ky, kx in factors],
+                                             'valid')
+                    mask_moment_cache[key] = moment
+                return moment
+
         if has_prior and boundary_correction_order >= 0:
             # Correct for edge effects
-            prior_mask = np.ones((ysize + 2 * winw, xsize + 2 * winw))
-            self._setEdgeMask2D(parx, pary, prior_mask, winw)
-            a00 = convolve2D(prior_mask, Win, 'valid', largest_size=convolvesize, cache=cache)
+            a00 = mask_moment()
             ix = a00 * bins2D > np.max(bins2D) * 1e-8
             a00 = a00[ix]
             normed = bins2D[ix] / a00
             if boundary_correction_order == 1:
                 # linear boundary correction
-                indexes = np.arange(-winw, winw + 1)
-                y = np.empty(Win.shape)
-                for i in range(Win.shape[0]):
-                    y[:, i] = indexes
-                winx = Win * indexes
-                winy = Win * y
-                a10 = convolve2D(prior_mask, winx, 'valid', largest_size=convolvesize, cache=cache)[ix]
-                a01 = convolve2D(prior_mask, winy, 'valid', largest_size=convolvesize, cache=cache)[ix]
-                a20 = convolve2D(prior_mask, winx * indexes, 'valid', largest_size=convolvesize, cache=cache,
-                                 cache_args=[1])[ix]
-                a02 = convolve2D(prior_mask, winy * y, 'valid', largest_size=convolvesize, cache=cache,
-                                 cache_args=[1])[ix]
-                a11 = convolve2D(prior_mask, winy * indexes, 'valid', largest_size=convolvesize, cache=cache,
-                                 cache_args=[1])[ix]
-                xP = convolve2D(histbins, winx, 'same', largest_size=convolvesize, cache=cache)[ix]
-                yP = convolve2D(histbins, winy, 'same', largest_size=convolvesize, cache=cache)[ix]
+                a10 = mask_moment(False, 1, 0)[ix]
+                a01 = mask_moment(False, 0, 1)[ix]
+                a20 = mask_moment(False, 2, 0)[ix]
+                a02 = mask_moment(False, 0, 2)[ix]
+                a11 = mask_moment(False, 1, 1)[ix]
+                xP = xP[ix]
+                yP = yP[ix]
                 denom = (a20 * a01 ** 2 + a10 ** 2 * a02 - a00 * a02 * a20 + a11 ** 2 * a00 - 2 * a01 * a10 * a11)
                 A = a11 ** 2 - a02 * a20
                 Ax = a10 * a02 - a01 * a11
@@ -1818,19 +2090,18 @@ class MCSamples(Chains):
                 raise SettingError('unknown boundary_correction_order (expected 0 or 1)')
 
         if mult_bias_correction_order:
-            prior_mask = np.ones((ysize + 2 * winw, xsize + 2 * winw))
-            self._setEdgeMask2D(parx, pary, prior_mask, winw, alledge=True)
-            a00 = convolve2D(prior_mask, Win, 'valid', largest_size=convolvesize, cache=cache, cache_args=[2])
+            a00 = mask_moment(alledge=True)
             for _ in range(mult_bias_correction_order):
                 box = histbins.copy()
                 ix2 = bins2D > np.max(bins2D) * 1e-8
                 box[ix2] /= bins2D[ix2]
-                bins2D *= convolve2D(box, Win, 'same', largest_size=convolvesize, cache=cache, cache_args=[2])
+                bins2D *= convolve2D(box, Win, 'same', largest_size=convolvesize, cache=cache, cache_args=[2],
+                                     shared_args=[2], dtype=fft_dtype)
                 bins2D /= a00
 
         x = np.linspace(xbinmin, xbinmax, xsize)
         y = np.linspace(ybinmin, ybinmax, ysize)
-        density = Density2D(x, y, bins2D,
+        density = Density2D(x, y, bins2D.astype(np.float64, copy=False),
                             view_ranges=[(parx.range_min, parx.range_max), (pary.range_min, pary.range_max)])
         density.normalize('max', in_place=True)
         if get_density:
@@ -2079,11 +2350,14 @@ class MCSamples(Chains):
             self.likeStats = None
             return None
         m = types.LikeStats()
-        bestfit_ix = np.argmin(self.loglikes)
+        # samples with zero weight (e.g. blocks dropped when resampling) are excluded
+        positive = self.weights > 0
+        loglikes = self.loglikes if np.all(positive) else self.loglikes[positive]
+        bestfit_ix = np.argmin(np.where(positive, self.loglikes, np.inf))
         maxlike = self.loglikes[bestfit_ix]
         m.logLike_sample = maxlike
         try:
-            if np.max(self.loglikes) - maxlike < 30:
+            if np.max(loglikes) - maxlike < 30:
                 m.logMeanInvLike = np.log(self.mean(np.exp(self.loglikes - maxlike))) + maxlike
             else:
                 m.logMeanInvLike = None
@@ -2097,22 +2371,44 @@ class MCSamples(Chains):
         m.names = self.paramNames.names
 
         # get N-dimensional confidence region
-        indexes = self.loglikes.argsort()
-        cumsum = np.cumsum(self.weights[indexes])
-        ncontours = len(self.contours)
-        m.ND_contours = np.searchsorted(cumsum, self.norm * self.contours[0:ncontours])
-        for j, par in enumerate(self.paramNames.names):
-            par.ND_limit_bot = np.empty(ncontours)
-            par.ND_limit_top = np.empty(ncontours)
-            for i, cont in enumerate(m.ND_contours):
-                region = self.samples[indexes[:cont], j]
-                par.ND_limit_bot[i] = np.min(region)
-                par.ND_limit_top[i] = np.max(region)
-            par.bestfit_sample = self.samples[bestfit_ix][j]
-
+        _, cumsum = self._likeSortOrder()
+        m.ND_contours = np.searchsorted(cumsum, self.norm * self.contours[0:len(self.contours)])
         self.likeStats = m
+        self._setParamLikeStats(None, bestfit_ix)
         return m
 
+    def _likeSortOrder(self):
+        # indices of the samples with non-zero weight sorted by likelihood, and their cumulative weights
+        conf = self._getCachedConfidenceData(-1)
+        positive = self.weights[conf.indexes] > 0
+        if np.all(positive):
+            return conf.indexes, conf.cumsum
+        return conf.indexes[positive], conf.cumsum[positive]
+
+    def _setParamLikeStats(self, j=None, bestfit_ix=None):
+        """
+        Set N-D confidence limits and best-fit sample value of parameter j (or all parameters if j is None).
+        Uses running minima and maxima of blocks of columns of the samples sorted by likelihood, so all contours are
+        done in one pass. Samples with zero weight are excluded.
+        """
+        indexes, _ = self._likeSortOrder()
+        ND_contours = self.likeStats.ND_contours
+        order = indexes[:np.max(ND_contours)]
+        ends = np.maximum(ND_contours, 1) - 1
+        if bestfit_ix is None:
+            bestfit_ix = np.argmin(np.where(self.weights > 0, self.loglikes, np.inf))
+        columns = range(self.n) if j is None else range(j, j + 1)
+        block = max(1, chains.cov_block_size // max(order.size, 1))
+        for start in range(columns.start, columns.stop, block):
+            cols = slice(start, min(start + block, columns.stop))
+            region = self.samples[order, cols]
+            tops = np.maximum.accumulate(region, axis=0)[ends]
+            bots = np.minimum.accumulate(region, axis=0, out=region)[ends]
+            for i, par in enumerate(self.paramNames.names[cols]):
+                par.ND_limit_bot = bots[:, i].copy()
+                par.ND_limit_top = tops[:, i].copy()
+                par.bestfit_sample = self.samples[bestfit_ix, start + i]
+
     def _readRanges(self):
         if self.root:
             ranges_file = self.root + '.ranges'
@@ -2184,22 +2480,40 @@ class MCSamples(Chains):
             raise MCSamplesError('Best fit can only be included if loaded from file and file_root%s exists '
                                  '(cannot be calculated from samples)' % ext)
 
-    def getMargeStats(self, include_bestfit=False):
+    def getMargeStats(self, include_bestfit=False, params=None):
         """
-        Returns a :class:`~.types.MargeStats` object with marginalized 1D parameter constraints
+        Returns a :class:`~.types.MargeStats` object with marginalized 1D parameter constraints.
+        Densities and limits are only calculated for parameters that do not already have them,
+        so asking for a few parameters only calculates those.
 
         :param include_bestfit: if True, set best fit values by loading from root_name.minimum file (assuming it exists)
+        :param params: optional list of parameter names (can include wildcards) to get statistics for,
+                       otherwise all parameters
         :return: A :class:`~.types.MargeStats` instance
         """
-        self._setDensitiesandMarge1D()
+        if params is None:
+            if self.lazy_derived:
+                self.materializeDerived()
+            self._setDensitiesandMarge1D()
+            names = self.paramNames.names
+        else:
+            names = self._margeParams(params)
+            self._setDensitiesandMarge1D(params=names)
         m = types.MargeStats()
         m.hasBestFit = False
         m.limits = self.contours
-        m.names = self.paramNames.names
+        m.names = names
         if include_bestfit:
             m.addBestFit(self.getBestFit())
         return m
 
+    def _margeParams(self, params, error=True):
+        # ParamInfo instances for list of names (or ParamInfo), evaluating any lazy derived parameters
+        names = [par.name if isinstance(par, ParamInfo) else par for par in makeList(params)]
+        if self.lazy_derived:
+            self.materializeDerived(names)
+        return [par for par in self.paramNames.parsWithNames(names, error=error) if par is not None]
+
     def getLikeStats(self):
         """
         Get best fit sample and n-D confidence limits, and various likelihood based statistics
@@ -2208,8 +2522,261 @@ class MCSamples(Chains):
                  result.names[i].ND_limit_top, result.names[i].ND_limit_bot, and best-fit sample value
                  in result.names[i].bestfit_sample
         """
+        if self.needs_update:
+            self.updateBaseStatistics()
         return self.likeStats or self._setLikeStats()
 
+    def importanceSampleVariants(self, logLikes, params=None, marge_stats=True, max_workers=None):
+        """
+        Importance sample against many alternative likelihoods at once, giving the same results as calling
+        :meth:`~.chains.WeightedSamples.reweightAddingLogLikes` on separate copies of these samples.
+        All the new weights and means are calculated together, and the returned samples share the sample arrays
+        (and parameter sort orders) of this instance rather than making copies. The variants' arrays are read-only
+        views (copy-on-write, as for :meth:`copy`). The variants are processed in parallel using a pool of threads.
+
+        :param logLikes: n_samples x n_variants array of -log(likelihood) values to add for each variant (or list
+                         of arrays), or a function that takes a :class:`~.chains.ParSamples` object (as returned by
+                         :meth:`~.chains.Chains.getParams`) and returns one.
+        :param params: optional list of parameters to calculate marginalized limits for (default: all)
+        :param marge_stats: if True, calculate 1D densities and marginalized limits for params
+        :param max_workers: maximum number of threads to use (default: num_threads setting, 0 for all cores)
+        :return: list of :class:`MCSamples` for each variant, with means, covariance, likelihood statistics and
+                 optionally 1D densities and limits already calculated (e.g. use :meth:`getMargeStats`)
+        """
+        if self.needs_update:
+            self.updateBaseStatistics()
+        if callable(logLikes):
+            logLikes = logLikes(self.getParams())
+        if isinstance(logLikes, (list, tuple)):
+            logLikes = np.column_stack(logLikes)
+        logLikes = np.asarray(logLikes, dtype=np.float64)
+        if logLikes.ndim == 1:
+            logLikes = logLikes[:, np.newaxis]
+        if logLikes.ndim != 2 or logLikes.shape[0] != self.numrows:
+            raise MCSamplesError('logLikes must have shape (n_samples, n_variants) = (%s, n_variants), got %s'
+                                 % (self.numrows, logLikes.shape))
+        weights = self.weights[:, np.newaxis] * np.exp(-(logLikes - np.min(logLikes, axis=0)))
+        means = weights.T.dot(self.samples) / np.sum(weights, axis=0)[:, np.newaxis]
+        return self._weightVariants(lambda i: weights[:, i], means, params, marge_stats, max_workers,
+                                    None if self.loglikes is None else lambda i: self.loglikes + logLikes[:, i])
+
+    def _parameterIndices(self, params):
+        if params is None:
+            if self.lazy_derived:
+                self.materializeDerived()
+            return list(range(self.n))
+        indices = [self._parAndNumber(name)[0] for name in params]
+        if None in indices:
+            raise ParamError('Unknown parameter in %s' % params)
+        return indices
+
+    def _weightVariants(self, variant_weights, means, params, marge_stats, max_workers, variant_loglikes=None,
+                        reduce=None, binning_plan=None):
+        """
+        Make reweighted copies of these samples in a pool of threads, sharing the sample array and sort orders.
+
+        :param variant_weights: function returning the weights for variant i
+        :param means: array of weighted means for each variant
+        :param params: list of parameters to calculate marginalized limits for, or None for all
+        :param marge_stats: if True, calculate 1D densities and marginalized limits for params
+        :param max_workers: maximum number of threads to use (default: num_threads setting, 0 for all cores)
+        :param variant_loglikes: function returning the -log(likelihood) for variant i, or None if unchanged
+        :param reduce: optional function applied to each variant, so that only its result is kept
+        :param binning_plan: optional :class:`BinningPlan` with fixed parameter ranges and bin indices to share
+        :return: list of the variants, or results of reduce
+        """
+        indices = self._parameterIndices(params)
+        sort_orders = {j: self._getCachedConfidenceData(j).indexes for j in range(self.n)}
+        if variant_loglikes is None and self.loglikes is not None:
+            sort_orders[-1] = self._getCachedConfidenceData(-1).indexes
+
+        def make_variant(i):
+            variant = self._makeReweighted(variant_weights(i), self.loglikes if variant_loglikes is None
+                                           else variant_loglikes(i), means[i], sort_orders)
+            if binning_plan is not None:
+                variant._binning_plan = binning_plan
+            if marge_stats:
+                for j in indices:
+                    par = variant.paramNames.names[j]
+                    paramConfid = variant.initParamConfidenceData(j)
+                    variant.get1DDensityGridData(j, paramConfid=paramConfid)
+                    variant._setMargeLimits(par, paramConfid)
+                    variant._marge1D_done.add(par.name)
+            return variant if reduce is None else reduce(variant)
+
+        num_threads = self.num_threads if max_workers is None else max_workers
+        if num_threads == 1:
+            return [make_variant(i) for i in range(len(means))]
+        with ThreadPoolExecutor(num_threads or None) as executor:
+            return list(executor.map(make_variant, range(len(means))))
+
+    def getResampledErrors(self, method='bootstrap', blocks='chains', num_resamples=100, params=None,
+                           like_limits=True, max_workers=None, random_state=None, pool=None):
+        """
+        Estimate Monte-Carlo errors on the means, marginalized limits and N-D likelihood limits by resampling
+        blocks of samples. Each resample is represented by multiplying the weights of each block by its number of
+        occurrences (zero if dropped), so the sample array is shared read-only between a pool of threads
+        (or worker processes if a pool is given).
+        Resamples also share parameter sort orders, the parameter ranges of this instance and the density binning.
+
+        :param method: "bootstrap" (sampling blocks with replacement) or "jackknife" (dropping one block at a time)
+        :param blocks: "chains" to resample separate chains, "correlation" to use contiguous blocks of the
+                       maximum parameter auto-correlation length (within each chain), or an integer block length
+        :param num_resamples: number of bootstrap resamples (jackknife uses one resample per block)
+        :param params: optional list of parameters to use (default: all)
+        :param like_limits: also estimate errors on the N-D likelihood limits (if loglikes available)
+        :param max_workers: maximum number of threads to use (default: num_threads setting, 0 for all cores)
+        :param random_state: random seed or Generator for the bootstrap
+        :param pool: optional :class:`~.parallel.SharedMemoryPool` for these samples, to evaluate the resamples in
+                     its worker processes rather than in threads
+        :return: a :class:`~.types.ResampledErrors` instance
+        """
+        if self.needs_update:
+            self.updateBaseStatistics()
+        indices = self._parameterIndices(params)
+        offsets = self._resampleBlockOffsets(blocks, indices)
+        nblocks = len(offsets) - 1
+        if nblocks < 2:
+            raise MCSamplesError('Need at least two blocks of samples for resampling')
+        if method == 'jackknife':
+            counts = 1 - np.eye(nblocks)
+        elif method == 'bootstrap':
+            counts = np.random.default_rng(random_state).multinomial(nblocks, np.ones(nblocks) / nblocks,
+                                                                     size=num_resamples).astype(np.float64)
+        else:
+            raise ValueError('Unknown resampling method: %s' % method)
+        lengths = np.diff(offsets)
+        block_norms = np.add.reduceat(self.weights, offsets[:-1])
+        block_sums = np.add.reduceat(self.weights[:, np.newaxis] * self.samples, offsets[:-1])
+        means = counts.dot(block_sums) / counts.dot(block_norms)[:, np.newaxis]
+        like_limits = like_limits and self.loglikes is not None
+
+        if pool is None:
+            results = self._resampledLimits(counts, lengths, means, indices, like_limits, max_workers)
+        else:
+            if pool.samples is not self:
+                raise MCSamplesError('pool was made for different samples')
+            chunks = np.array_split(np.arange(len(counts)), min(len(counts), 4 * pool.max_workers))
+            results = [res for chunk_results in
+                       pool.map(_resampledLimitsTask, [(counts[chunk], lengths, means[chunk], indices, like_limits)
+                                                       for chunk in chunks])
+                       for res in chunk_results]
+        limits = np.array([res[0] for res in results])
+        like = np.array([res[1] for res in results]) if like_limits else None
+
+        def spread(values):
+            if method == 'jackknife':
+                return np.sqrt((nblocks - 1) * np.mean((values - np.mean(values, axis=0)) ** 2, axis=0))
+            return np.std(values, axis=0, ddof=1)
+
+        return types.ResampledErrors([self.paramNames.names[j] for j in indices], method, len(counts), nblocks,
+                                     spread(means[:, indices]), spread(limits),
+                                     None if like is None else spread(like))
+
+    def _resampledLimits(self, counts, lengths, means, indices, like_limits, max_workers=None):
+        """
+        Get the marginalized limits (and N-D likelihood limits) of each resample, given the number of copies of
+        each block of samples in each resample, using max_workers threads (default: num_threads setting)
+        """
+        for j in indices:
+            self._getBinIndices(j, self._initParamRanges(j), self.fine_bins)
+
+        def resample_stats(variant):
+            limits = np.array([[[lim.lower, lim.upper] for lim in variant.paramNames.names[j].limits]
+                               for j in indices])
+            if like_limits:
+                likeStats = variant.getLikeStats()
+                pars = [likeStats.names[j] for j in indices]
+                return limits, np.array([np.stack([par.ND_limit_bot, par.ND_limit_top], axis=-1) for par in pars])
+            return limits, None
+
+        return self._weightVariants(lambda i: self.weights * np.repeat(counts[i], lengths), means,
+                                    [self.paramNames.names[j].name for j in indices], True, max_workers,
+                                    reduce=resample_stats, binning_plan=self._binning_plan)
+
+    def _resampleBlockOffsets(self, blocks, indices):
+        """
+        Get the start offsets of the blocks of samples to use for resampling (followed by the total number of rows)
+        """
+        if isinstance(blocks, str) and blocks == 'chains':
+            if self.chain_offsets is None:
+                raise MCSamplesError('Samples were not combined from separate chains, use blocks="correlation"')
+            return np.asarray(self.chain_offsets)
+        chain_offsets = [0, self.numrows] if self.chain_offsets is None else self.chain_offsets
+        if isinstance(blocks, str):
+            if blocks != 'correlation':
+                raise ValueError('Unknown resampling blocks: %s' % blocks)
+            blocks = max(int(np.ceil(self.getCorrelationLength(j, weight_units=False))) for j in indices)
+        offsets = [np.arange(start, end, max(1, int(blocks))) for start, end in
+                   zip(chain_offsets[:-1], chain_offsets[1:])]
+        return np.concatenate(offsets + [[self.numrows]])
+
+    def getParamSubset(self, params, label=None):
+        """
+        Make a new :class:`MCSamples` instance with only a subset of the parameters, keeping the same
+        order of parameters as in this instance. Statistics and densities already calculated for the parameters
+        are kept. The samples are a (read-only) view of this instance's samples when the selected columns are
+        evenly spaced (e.g. any contiguous range), otherwise a copy of the selected columns. Weights and
+        loglikes are always shared, as for :meth:`copy`.
+
+        :param params: list of parameter names (can include wildcards)
+        :param label: optional label for the new samples
+        :return: :class:`MCSamples` instance
+        """
+        if self.lazy_derived:
+            self.materializeDerived(params)
+        keep = sorted(set(self.paramNames.numberOfName(par.name) for par in
+                          self.paramNames.parsWithNames(params, error=True)))
+        new = self.copy(label=label)
+        if len(keep) == 1 or len(set(np.diff(keep))) == 1:
+            step = keep[1] - keep[0] if len(keep) > 1 else 1
+            new.samples = new.samples[:, keep[0]:keep[-1] + 1:step]
+        else:
+            new.samples = new.samples[:, keep]
+        new.n = len(keep)
+        new.lazy_derived = {}
+        new._columnsDeleted([i for i in range(self.n) if i not in keep])
+        return new
+
+    def _makeReweighted(self, weights, loglikes, means, sort_orders):
+        """
+        Make a copy of this instance with new weights, sharing the (read-only, copy-on-write) sample array.
+
+        :param weights: the new weights
+        :param loglikes: the new -log(likelihood) values
+        :param means: the weighted means with the new weights
+        :param sort_orders: dictionary of argsort indices of each parameter (and loglikes if unchanged, index -1)
+        :return: new :class:`MCSamples` instance with updated base statistics
+        """
+        # variants get read-only views, so changing the samples of a variant (or this instance) makes a copy first
+        shared = self._sharedArraysMemo()
+        if loglikes is self.loglikes and loglikes is not None:
+            loglikes = shared[id(loglikes)]
+        new = copy.copy(self)
+        new._shared_arrays = frozenset()
+        new.samples = shared[id(self.samples)]
+        new.paramNames = copy.deepcopy(self.paramNames)
+        new.ranges = copy.deepcopy(self.ranges)
+        new.index = dict(self.index)
+        new.lazy_derived = dict(self.lazy_derived)
+        new.chains = None
+        new.weights = weights
+        new.loglikes = loglikes
+        new._weightsChanged()
+        new._sort_cache = {j: chains.ParamConfidenceData(paramVec=new.samples[:, j] if j >= 0 else loglikes,
+                                                         norm=new.norm, indexes=indexes,
+                                                         cumsum=np.cumsum(weights[indexes]))
+                           for j, indexes in sort_orders.items()}
+        new.means = means
+        new.mean_loglike = None if loglikes is None else weights.dot(loglikes) / new.norm
+        new.fullcov = chains._weighted_cov_sum(self.samples, weights, means) / new.norm
+        new.vars = np.diag(new.fullcov).copy()
+        new.sddev = np.sqrt(new.vars)
+        new.mean_mult = new.norm / new.numrows
+        new.max_mult = np.max(weights)
+        new.needs_update = False
+        return new._resetDependentStatistics()
+
     def getTable(self, columns=1, include_bestfit=False, **kwargs):
         """
         Creates and returns a :class:`~.types.ResultTable` instance. See also :func:`~MCSamples.getInlineLatex`.
@@ -2219,7 +2786,12 @@ class MCSamples(Chains):
         :param kwargs: arguments for :class:`~.types.ResultTable` constructor.
         :return: A :class:`~.types.ResultTable` instance
         """
-        return types.ResultTable(columns, [self.getMargeStats(include_bestfit)], **kwargs)
+        params = kwargs.get('paramList')
+        if params is None and kwargs.get('tableParamNames') is not None:
+            params = kwargs['tableParamNames'].list()
+        if params is not None:
+            params = [par.name for par in self._margeParams(params, error=False)]
+        return types.ResultTable(columns, [self.getMargeStats(include_bestfit, params=params)], **kwargs)
 
     def getLatex(self, params=None, limit=1, err_sig_figs=None):
         """
@@ -2235,9 +2807,11 @@ class MCSamples(Chains):
         if isinstance(params, str):
             return self.getInlineLatex(params, limit, err_sig_figs)
 
-        marge = self.getMargeStats()
         if params is None:
+            marge = self.getMargeStats()
             params = marge.list()
+        else:
+            marge = self.getMargeStats(params=self._margeParams(params, error=False))
 
         formatter = types.NoLineTableFormatter()
         if err_sig_figs:
@@ -2273,22 +2847,48 @@ class MCSamples(Chains):
         else:
             return labels[0] + ' ' + texs[0]
 
-    def _setDensitiesandMarge1D(self, max_frac_twotail=None, meanlikes=False):
+    def _setDensitiesandMarge1D(self, max_frac_twotail=None, meanlikes=False, params=None):
         """
         Get all the 1D densities; result is cached.
 
         :param max_frac_twotail: optional override for self.max_frac_twotail
         :param meanlikes: include mean likelihoods
+        :param params: optional list of :class:`~.paramnames.ParamInfo` to calculate, otherwise all parameters
         """
+        if self.needs_update:
+            self.updateBaseStatistics()
         if self.done_1Dbins:
             return
 
-        for j in range(self.n):
-            paramConfid = self.initParamConfidenceData(self.samples[:, j])
-            self.get1DDensityGridData(j, paramConfid=paramConfid, meanlikes=meanlikes)
-            self._setMargeLimits(self.paramNames.names[j], paramConfid, max_frac_twotail)
+        def marge1D(block):
+            paramConfids = [self.initParamConfidenceData(j) for j in block]
+            densities = self._get1DDensities(block, paramConfids, meanlikes=meanlikes)
+            for j, paramConfid, density in zip(block, paramConfids, densities):
+                par = self.paramNames.names[j]
+                self._setMargeLimits(par, paramConfid, max_frac_twotail, density1D=density)
+                self._marge1D_done.add(par.name)
 
-        self.done_1Dbins = True
+        if params is None:
+            indices = [j for j, par in enumerate(self.paramNames.names) if par.name not in self._marge1D_done]
+        else:
+            indices = [self.index[par.name] for par in params if par.name not in self._marge1D_done]
+        if self.num_threads == 1 or len(indices) < 2:
+            blocks = [indices[i:i + batch1D_columns] for i in range(0, len(indices), batch1D_columns)]
+            for block in blocks:
+                marge1D(block)
+        else:
+            # split parameters evenly between the threads, in blocks that are binned and smoothed together
+            size = min(batch1D_columns, -(-len(indices) // (self.num_threads or os.cpu_count() or 1)))
+            blocks = [indices[i:i + size] for i in range(0, len(indices), size)]
+            # parameters are independent; shared statistics are calculated first so each thread only
+            # sets its own parameter's density and limits
+            if self.range_ND_contour >= 0 and self.loglikes is not None:
+                self.getLikeStats()
+            with ThreadPoolExecutor(self.num_threads or None) as executor:
+                list(executor.map(marge1D, blocks))
+
+        if params is None or len(self._marge1D_done) == self.n:
+            self.done_1Dbins = True
 
     # noinspection PyUnboundLocalVariable
     def _setMargeLimits(self, par, paramConfid, max_frac_twotail=None, density1D=None):
@@ -2455,25 +3055,8 @@ class MCSamples(Chains):
         :return: a new  :class:`MCSamples` instance with the combined samples
         """
 
-        params = ParamNames()
-        params.names = [ParamInfo(name=p.name, label=p.label, derived=p.isDerived) for p in samps2.paramNames.names if
-                        p.name in self.paramNames.list()]
-        if self.loglikes is not None and samps2.loglikes is not None:
-            loglikes = np.concatenate([self.loglikes, samps2.loglikes])
-        else:
-            loglikes = None
-        if sample_weights is None:
-            fac = 1
-            sample_weights = (1, 1)
-        else:
-            fac = np.sum(self.weights) / np.sum(samps2.weights)
-        weights = np.concatenate([self.weights * sample_weights[0], samps2.weights * sample_weights[1] * fac])
-        p1 = self.getParams()
-        p2 = samps2.getParams()
-        samples = np.array([np.concatenate([getattr(p1, name), getattr(p2, name)]) for name in params.list()]).T
-        samps = MCSamples(samples=samples, weights=weights, loglikes=loglikes, paramNamesFile=params, ignore_rows=0,
-                          ranges=self.ranges, settings=copy.deepcopy(self.ini.params))
-        return samps
+        names = [p.name for p in samps2.paramNames.names if p.name in self.paramNames.list()]
+        return combineSamples([self, samps2], sample_weights=sample_weights, params=names)
 
     def saveTextMetadata(self, root, properties=None):
         """
@@ -2613,6 +3196,69 @@ class MCSamples(Chains):
 # Useful functions
 
 
+def combineSamples(samples_list, sample_weights=(), params=None, label=None) -> MCSamples:
+    """
+    Make a new :class:`MCSamples` instance by combining samples from a list of :class:`MCSamples` instances, for
+    parameters which are in common. By default they are weighted so that the probability mass of each set of samples
+    is the same, independent of the actual sample sizes. The sample_weights parameter can be used to change the
+    relative weighting.
+
+    The combined samples are written directly into one output array. Separate chains of each input (or each input,
+    if not from separate chains) are kept as separate chains of the result, so convergence diagnostics and
+    :meth:`~.chains.Chains.getSeparateChains` still work per source.
+
+    :param samples_list: list of :class:`MCSamples` instances to combine
+    :param sample_weights: relative weights for combining each set of samples (default: all 1).
+                           Set to None to just directly append samples without rescaling the weights.
+    :param params: optional list of parameter names to include, by default all parameters of the first samples
+                   that are in common to all of them
+    :param label: optional label for the new samples
+    :return: a new :class:`MCSamples` instance with the combined samples
+    """
+    first = samples_list[0]
+    if params is None:
+        params = [name for name in first.paramNames.list() if
+                  all(samps.paramNames.numberOfName(name) >= 0 for samps in samples_list[1:])]
+    paramNames = ParamNames()
+    paramNames.names = [ParamInfo(name=p.name, label=p.label, derived=p.isDerived) for p in
+                        (first.paramNames.parWithName(name, error=True) for name in params)]
+    if sample_weights is None:
+        factors = np.ones(len(samples_list))
+    else:
+        sample_weights = list(sample_weights) or [1] * len(samples_list)
+        if len(sample_weights) != len(samples_list):
+            raise MCSamplesError('sample_weights must have one entry for each set of samples')
+        norms = np.array([np.sum(samps.weights) for samps in samples_list])
+        factors = np.array(sample_weights, dtype=np.float64) * norms[0] / norms
+    numrows = [samps.samples.shape[0] for samps in samples_list]
+    samples = np.empty((sum(numrows), len(params)))
+    weights = np.empty(samples.shape[0])
+    has_loglikes = all(samps.loglikes is not None for samps in samples_list)
+    loglikes = np.empty(samples.shape[0]) if has_loglikes else None
+    offsets = [0]
+    start = 0
+    for samps, rows, factor in zip(samples_list, numrows, factors):
+        indices = [samps.paramNames.numberOfName(name) for name in params]
+        if min(indices) < 0:
+            raise ParamError('Parameters %s not in all samples' % [name for name, i in zip(params, indices) if i < 0])
+        end = start + rows
+        if indices == list(range(len(indices))):
+            samples[start:end] = samps.samples[:, :len(indices)]
+        else:
+            samples[start:end] = samps.samples[:, indices]
+        np.multiply(samps.weights, factor, out=weights[start:end])
+        if has_loglikes:
+            loglikes[start:end] = samps.loglikes
+        chain_offsets = samps.chain_offsets if samps.chain_offsets is not None else [0, rows]
+        offsets.extend(start + off for off in chain_offsets[1:])
+        start = end
+    combined = MCSamples(paramNamesFile=paramNames, ignore_rows=0, ranges=first.ranges,
+                         settings=copy.deepcopy(first.ini.params), label=label)
+    combined.chain_offsets = np.array(offsets)
+    combined.readChains(samples, weights, loglikes)
+    return combined
+
+
 def getRootFileName(rootdir):
     """
     Gets the root name of chains in given directory (assuming only one set of chain files).
@@ -2631,5 +3277,23 @@ def getRootFileName(rootdir):
     return rootFileName
 
 
+def _cachedMaskMoments(keys, calculate):
+    # mask convolutions for a set of rows (e.g. parameters) from mask_moment_cache, with missing rows calculated
+    # together using calculate(row_indices), which returns an array with shape (moments, rows, bins)
+    results = [mask_moment_cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        calculated = calculate(missing)
+        for n, i in enumerate(missing):
+            results[i] = calculated[:, n].copy()
+            mask_moment_cache[keys[i]] = results[i]
+    return np.stack(results, axis=1)
+
+
+def _resampledLimitsTask(samples, task):
+    # evaluated in SharedMemoryPool worker processes for getResampledErrors
+    return samples._resampledLimits(*task)
+
+
 def _dummy_usage():
     assert MCSamplesFromCobaya and ParamError
@@ -0,0 +1,177 @@
+"""
+Process pool for analysing :class:`~.mcsamples.MCSamples` in parallel without copying the samples to each task.
+
+Threads (e.g. the num_threads analysis setting) share the samples for free, but the Python-heavy parts of the kernel
+density and bandwidth calculations then contend for the GIL. :class:`SharedMemoryPool` instead copies the samples,
+weights and loglikes into :mod:`multiprocessing.shared_memory` once, and starts a persistent pool of worker processes
+that each attach to the shared arrays and rebuild a lightweight copy of the :class:`~.mcsamples.MCSamples` (parameter
+names, ranges, settings and base statistics). Tasks then only send small arguments and results between processes.
+"""
+
+import copy
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import shared_memory
+import numpy as np
+from getdist.mcsamples import batch1D_columns
+
+shared_attributes = ('samples', 'weights', 'loglikes')
+
+# MCSamples instance rebuilt in each worker process
+_worker_samples = None
+_worker_blocks = []
+
+
+def _initWorker(state, handles):
+    global _worker_samples, _worker_blocks
+    _worker_blocks = []
+    for attr, (name, shape, dtype) in handles.items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks.append(block)
+        arr = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        # read-only, so any method changing the values makes a private copy first
+        arr.flags.writeable = False
+        setattr(state, attr, arr)
+    _worker_samples = state
+
+
+def _runTask(function, item):
+    return function(_worker_samples, item)
+
+
+def _release(executor, blocks):
+    executor.shutdown()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _densities1D(samples, task):
+    params, meanlikes, kwargs = task
+    return samples.get1DDensities(params, meanlikes=meanlikes, **kwargs)
+
+
+def _densities2D(samples, task):
+    pairs, kwargs = task
+    return samples.get2DDensities(pairs, max_workers=1, **kwargs)
+
+
+class SharedMemoryPool:
+    """
+    Persistent pool of worker processes sharing the sample arrays of a :class:`~.mcsamples.MCSamples` instance
+    through shared memory. The workers use a snapshot of the samples and settings when the pool is made, so make a
+    new pool after changing the samples (e.g. adding derived parameters or re-weighting).
+    Use as a context manager, or call :meth:`close` when finished to stop the workers and free the shared memory.
+
+    For example::
+
+        with SharedMemoryPool(samples) as pool:
+            densities = pool.get1DDensities()
+            errors = samples.getResampledErrors(pool=pool)
+
+    :ivar samples: the :class:`~.mcsamples.MCSamples` instance
+    :ivar max_workers: number of worker processes
+    """
+
+    def __init__(self, samples, max_workers=None, mp_context=None):
+        """
+        :param samples: :class:`~.mcsamples.MCSamples` instance
+        :param max_workers: number of worker processes (default: number of cores)
+        :param mp_context: optional multiprocessing context used to start the workers
+        """
+        if samples.needs_update:
+            samples.updateBaseStatistics()
+        self.samples = samples
+        self.max_workers = max_workers or os.cpu_count() or 1
+        blocks = []
+        handles = {}
+        try:
+            for attr in shared_attributes:
+                arr = getattr(samples, attr)
+                if arr is None:
+                    continue
+                block = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+                blocks.append(block)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+                handles[attr] = (block.name, arr.shape, arr.dtype.str)
+        except BaseException:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        # pickled state excludes the sort orders and binning plan, and here also the arrays themselves
+        state = copy.copy(samples)
+        for attr in shared_attributes:
+            setattr(state, attr, None)
+        state.chains = None
+        state.num_threads = 1
+        executor = ProcessPoolExecutor(self.max_workers, mp_context=mp_context, initializer=_initWorker,
+                                       initargs=(state, handles))
+        self._executor = executor
+        self._finalizer = weakref.finalize(self, _release, executor, blocks)
+
+    def map(self, function, items, chunksize=1):
+        """
+        Evaluate function(samples, item) for each item in the worker processes, where samples is the worker's copy
+        of the :class:`~.mcsamples.MCSamples` (with read-only arrays in shared memory).
+
+        :param function: module-level (picklable) function taking the samples and an item
+        :param items: iterable of (picklable) items
+        :param chunksize: number of items sent to a worker at once
+        :return: list of results
+        """
+        return list(self._executor.map(_runTask, repeat(function), items, chunksize=chunksize))
+
+    def _split(self, items, max_size=None):
+        items = list(items)
+        size = -(-len(items) // self.max_workers) if items else 1
+        if max_size:
+            size = min(size, max_size)
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def get1DDensities(self, params=None, meanlikes=False, **kwargs):
+        """
+        Get 1D marginalized densities as for :meth:`~.mcsamples.MCSamples.get1DDensities`, with blocks of
+        parameters calculated in the worker processes. Results are cached in the samples if no kwargs are given.
+
+        :param params: list of parameter names or indices, default all parameters
+        :param meanlikes: include mean likelihoods
+        :param kwargs: optional settings to override instance settings, as for
+                       :meth:`~.mcsamples.MCSamples.get1DDensityGridData`
+        :return: list of :class:`~.densities.Density1D` instances
+        """
+        indices = self.samples._parameterIndices(params)
+        densities = [density for result in
+                     self.map(_densities1D, [(block, meanlikes, kwargs)
+                                             for block in self._split(indices, batch1D_columns)])
+                     for density in result]
+        if not kwargs:
+            for j, density in zip(indices, densities):
+                self.samples.density1D[self.samples.parName(j)] = density
+        return densities
+
+    def get2DDensities(self, pairs, **kwargs):
+        """
+        Get 2D marginalized densities for many pairs of parameters as for
+        :meth:`~.mcsamples.MCSamples.get2DDensities`, with the pairs split between the worker processes.
+
+        :param pairs: list of [x, y] parameter name or index pairs
+        :param kwargs: other arguments for :meth:`~.mcsamples.MCSamples.get2DDensities`
+        :return: list of :class:`~.densities.Density2D` instances
+        """
+        return [density for result in self.map(_densities2D, [(block, kwargs) for block in self._split(pairs)])
+                for density in result]
+
+    def close(self):
+        """
+        Stop the worker processes and free the shared memory.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
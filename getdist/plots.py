@@ -614,6 +614,35 @@ class MCSampleAnalysis(_BaseObject):
             rootdata[key] = density
         return density
 
+    def get_density_grids(self, root, param_pairs, conts=2, likes=False):
+        """
+        Get 2D marginalized densities for given root name and many parameter pairs. Any densities not already
+        cached are calculated together using :meth:`~.mcsamples.MCSamples.get2DDensities`, in parallel threads
+        unless the num_threads analysis setting is 1.
+
+        :param root: The root name for samples to use.
+        :param param_pairs: list of [x, y] parameter pairs
+        :param conts: number of contour levels (up to maximum calculated using contours in analysis settings)
+        :param likes: whether to include mean likelihoods
+        :return: list of :class:`~.densities.Density2D` instances with marginalized densities
+        """
+        rootdata = self.densities_2D.get(root)
+        if not rootdata:
+            rootdata = {}
+            self.densities_2D[root] = rootdata
+        todo = {}
+        for param1, param2 in param_pairs:
+            key = (param1.name, param2.name, likes, conts)
+            if not rootdata.get(key):
+                todo[key] = (param1.name, param2.name)
+        if todo:
+            samples = self.samples_for_root(root)
+            for key, density in zip(todo, samples.get2DDensities(list(todo.values()), num_plot_contours=conts,
+                                                                 meanlikes=likes)):
+                if density is not None:
+                    rootdata[key] = density
+        return [self.get_density_grid(root, param1, param2, conts, likes) for param1, param2 in param_pairs]
+
     def load_single_samples(self, root):
         """
         Gets a set of unit weight samples for given root name, e.g. for making sample scatter plot
@@ -1806,6 +1835,7 @@ class GetDistPlotter(_BaseObject):
 
         if params is None or len(params) == 0:
             return names.names
+        self._materialize_derived(root, params)
         # Fail only for parameters for which a string was passed
         if isinstance(params, str):
             return names.parsWithNames(params, error=True, renames=renames)
@@ -1824,6 +1854,19 @@ class GetDistPlotter(_BaseObject):
             return [new or old for new, old in zip(names.parsWithNames(params_names,
                                                                        error=error, renames=renames), old)]
 
+    def _materialize_derived(self, root, params):
+        """
+        Evaluates any of the requested parameters that are lazy derived parameters of the samples for root
+        (see :meth:`~.chains.Chains.addDerivedExpr`).
+
+        :param root: The root name of the samples, or samples object
+        :param params: parameter name or list of names
+        """
+        if isinstance(root, str):
+            root = self.samples_for_root(root)
+        if isinstance(root, MCSamples) and root.lazy_derived:
+            root.materializeDerived([getattr(param, 'name', param) for param in makeList(params)])
+
     def _check_param(self, root, param, renames=None):
         """
         Get :class:`~.paramnames.ParamInfo` for given name for samples with specified root
@@ -1846,6 +1889,7 @@ class GetDistPlotter(_BaseObject):
                     renames = {name: list(param.renames)}
         else:
             name = param
+        self._materialize_derived(root, name)
         # NB: If a parameter is not found, errors only if param is a ParamInfo instance
         return self.param_names_for_root(root).parWithName(name, error=(name == param), renames=renames)
 
@@ -2192,6 +2236,7 @@ class GetDistPlotter(_BaseObject):
         if filled and shaded:
             raise GetDistPlotError("Plots cannot be both filled and shaded")
         plot_col, plot_row = self.make_figure(len(pairs), nx=nx)
+        self._get_densities_2d([(roots, pair) for pair in pairs])
 
         for i, pair in enumerate(pairs):
             ax = self._subplot_number(i, pars=pair)
@@ -2302,6 +2347,30 @@ class GetDistPlotter(_BaseObject):
                 return markers[index]
         return None
 
+    def _get_densities_2d(self, subplots):
+        """
+        Calculate the 2D densities needed for a set of subplots together before any plotting, so that those for
+        the same samples can be calculated in parallel (see :meth:`MCSampleAnalysis.get_density_grids`).
+
+        :param subplots: list of (roots, [x, y] parameter pair) for each subplot
+        """
+        root_pairs = []
+        for roots, param_pair in subplots:
+            roots = makeList(roots)
+            if not roots:
+                continue
+            param_pair = self.get_param_array(roots[0], param_pair)
+            for root in roots:
+                if isinstance(root, (str, MCSamples)):
+                    pairs = next((pairs for _root, pairs in root_pairs if _root is root), None)
+                    if pairs is None:
+                        pairs = []
+                        root_pairs.append((root, pairs))
+                    pairs.append(self.get_param_array(root, param_pair))
+        for root, pairs in root_pairs:
+            self.sample_analyser.get_density_grids(root, pairs, conts=self.settings.num_plot_contours,
+                                                   likes=self.settings.shade_meanlikes)
+
     @staticmethod
     def _make_param_object(names, samples, obj=None):
         class SampleNames:
@@ -2449,6 +2518,13 @@ class GetDistPlotter(_BaseObject):
                     roots1d.append(root)
                     line_args.append(arg)
 
+        if plot_3d_with_param is None:
+            subplots = [(roots, [param, param2]) for i, param in enumerate(params) for param2 in params[i + 1:]]
+            if upper_roots is not None:
+                subplots += [(upper_roots, [param2, param]) for i, param in enumerate(params)
+                             for param2 in params[i + 1:]]
+            self._get_densities_2d(subplots)
+
         bottom = len(params) - 1
         for i, param in enumerate(params):
             for i2 in range(bottom, i, -1):
@@ -2645,6 +2721,9 @@ class GetDistPlotter(_BaseObject):
             raise GetDistPlotError('rectangle plot: must have one of roots, yroots, plot_roots')
         if roots:
             roots = makeList(roots)
+        self._get_densities_2d([(subplot_roots, [xparam, yparam]) for x, xparam in enumerate(xparams) for
+                                yparam, subplot_roots in zip(yparams, plot_roots[x] if plot_roots else
+                                                             [roots for _ in yparams] if roots else yroots)])
         limits = dict()
         for x, xparam in enumerate(xparams):
             sharex = None
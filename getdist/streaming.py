@@ -0,0 +1,399 @@
+"""
+Online accumulation of weighted sample statistics, for monitoring samplers while they are still running.
+
+:class:`StreamingSamples` ingests blocks of rows (e.g. from a sampler callback, or new lines appended to chain files)
+and keeps running weighted means, covariances, per-chain moments and fixed-grid 1D histograms, so that the cost of
+each update only depends on the number of new rows.
+"""
+
+import copy
+import io
+import numpy as np
+from getdist import types
+from getdist.densities import Density1D
+from getdist.paramnames import ParamNames
+from getdist.chains import chainFiles, WeightedSampleError, _weighted_cov_sum, _gelman_rubin_eigenvalues
+
+
+class MomentSums:
+    """
+    Running weighted normalization, mean and co-moment (sum of weighted outer products of differences from the mean)
+    of a set of samples. Blocks of samples are combined using the pairwise update of Chan, Golub & LeVeque.
+
+    :ivar norm: total weight
+    :ivar mean: array of weighted means
+    :ivar comoment: sum_i w_i (x_i - mean)(x_i - mean)^T
+    """
+
+    def __init__(self, n):
+        """
+        :param n: number of parameters
+        """
+        self.norm = 0.
+        self.mean = np.zeros(n)
+        self.comoment = np.zeros((n, n))
+
+    @staticmethod
+    def blockMoments(samples, weights):
+        """
+        Get the moments of a block of samples.
+
+        :param samples: n_samples x n_parameters array
+        :param weights: array of weights
+        :return: tuple of norm, mean, comoment
+        """
+        norm = np.sum(weights)
+        mean = weights.dot(samples) / norm
+        return norm, mean, _weighted_cov_sum(samples, weights, mean)
+
+    def merge(self, norm, mean, comoment):
+        """
+        Add the moments of another set of samples.
+
+        :param norm: total weight of the other samples
+        :param mean: means of the other samples
+        :param comoment: co-moment of the other samples
+        """
+        if norm <= 0:
+            return
+        total = self.norm + norm
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * (self.norm * norm / total)
+        self.mean += delta * (norm / total)
+        self.norm = total
+
+    def add(self, samples, weights):
+        """
+        Add a block of samples.
+
+        :param samples: n_samples x n_parameters array
+        :param weights: array of weights
+        """
+        self.merge(*self.blockMoments(samples, weights))
+
+    def getCov(self):
+        """
+        :return: the weighted covariance matrix
+        """
+        return self.comoment / self.norm
+
+
+class StreamingSamples:
+    """
+    Accumulates statistics of weighted samples as they are produced, without storing the samples themselves
+    (unless keep_samples is True). Each call to :meth:`add` or :meth:`readFile` only processes the new rows.
+
+    Maintains the overall weighted means and covariance, the moments of each separate chain (for the Gelman-Rubin
+    convergence statistic), the best-fit sample, and weighted histograms of each parameter on a fixed grid
+    (used for approximate marginalized limits).
+
+    For example, to monitor a running chain::
+
+        stats = StreamingSamples(paramNamesFile=root + '.paramnames')
+        while running:
+            stats.readChainFiles(root)
+            print(stats.getGelmanRubin())
+    """
+
+    def __init__(self, names=None, labels=None, paramNamesFile=None, ranges=None, hist_bins=256, hist_pad=0.5,
+                 keep_samples=False):
+        """
+        :param names: list of parameter names. If not set (and no paramNamesFile), default names are generated from
+                      the number of columns in the first block of samples.
+        :param labels: optional list of latex labels for the parameters
+        :param paramNamesFile: optional name of .paramnames file with parameter names
+        :param ranges: optional dictionary (or list) of [min, max] ranges for the fixed histogram grid of each
+                       parameter. Parameters without a range use the range of the first block of samples, padded
+                       by hist_pad times the width on each side.
+        :param hist_bins: number of histogram bins for each parameter
+        :param hist_pad: fractional padding of histogram ranges determined from the first block of samples
+        :param keep_samples: if True, also store the samples so that :meth:`makeMCSamples` can be used
+        """
+        if paramNamesFile is not None or names is not None:
+            self.paramNames = ParamNames(paramNamesFile, names=names, labels=labels)
+        else:
+            self.paramNames = None
+            self._labels = labels
+        self.ranges = ranges
+        self.hist_bins = hist_bins
+        self.hist_pad = hist_pad
+        self.keep_samples = keep_samples
+        self.n = None
+        self.total = None
+        self.chains = {}
+        self.chain_samples = {}
+        self.hist_min = None
+        self.hist_width = None
+        self.hist = None
+        self.underflow = None
+        self.overflow = None
+        self.num_rows = 0
+        self.best_loglike = None
+        self.best_sample = None
+        self._loglike_sum = 0.
+        self._loglike_norm = 0.
+        self._file_offsets = {}
+
+    def _initParams(self, samples):
+        self.n = samples.shape[1]
+        if self.paramNames is None:
+            self.paramNames = ParamNames(default=self.n)
+            if self._labels is not None:
+                self.paramNames.setLabels(self._labels)
+        elif self.paramNames.numParams() != self.n:
+            raise WeightedSampleError('Number of sample columns (%s) does not match number of parameter names (%s)'
+                                      % (self.n, self.paramNames.numParams()))
+        self.total = MomentSums(self.n)
+        self.hist_min = np.empty(self.n)
+        self.hist_width = np.empty(self.n)
+        for i, name in enumerate(self.paramNames.list()):
+            if isinstance(self.ranges, dict):
+                lims = self.ranges.get(name)
+            elif self.ranges is not None:
+                lims = self.ranges[i]
+            else:
+                lims = None
+            if lims is None:
+                mn, mx = np.min(samples[:, i]), np.max(samples[:, i])
+                pad = (mx - mn) * self.hist_pad or max(abs(mn), 1.) * 1e-6
+                lims = [mn - pad, mx + pad]
+            self.hist_min[i] = lims[0]
+            self.hist_width[i] = (lims[1] - lims[0]) / self.hist_bins
+        self.hist = np.zeros((self.n, self.hist_bins))
+        self.underflow = np.zeros(self.n)
+        self.overflow = np.zeros(self.n)
+
+    def _addHistograms(self, samples, weights):
+        bins = np.floor((samples - self.hist_min) / self.hist_width).astype(np.int64)
+        w = np.broadcast_to(weights[:, np.newaxis], bins.shape)
+        low = bins < 0
+        high = bins >= self.hist_bins
+        self.underflow += np.sum(np.where(low, w, 0), axis=0)
+        self.overflow += np.sum(np.where(high, w, 0), axis=0)
+        valid = ~(low | high)
+        flat = (bins + np.arange(self.n) * self.hist_bins)[valid]
+        self.hist += np.bincount(flat, weights=w[valid], minlength=self.n * self.hist_bins).reshape(self.hist.shape)
+
+    def add(self, samples, weights=None, loglikes=None, chain=0):
+        """
+        Add a block of new samples.
+
+        :param samples: n_samples x n_parameters array of parameter values
+        :param weights: optional array of weights (default all 1)
+        :param loglikes: optional array of -log(Likelihood)
+        :param chain: identifier of the chain the samples belong to (any hashable value)
+        :return: self
+        """
+        samples = np.atleast_2d(np.asarray(samples, dtype=np.float64))
+        if not samples.shape[0]:
+            return self
+        if weights is None:
+            weights = np.ones(samples.shape[0])
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+        if self.n is None:
+            self._initParams(samples)
+        elif samples.shape[1] != self.n:
+            raise WeightedSampleError('Expected samples with %s columns, got %s' % (self.n, samples.shape[1]))
+        moments = MomentSums.blockMoments(samples, weights)
+        if chain not in self.chains:
+            self.chains[chain] = MomentSums(self.n)
+        self.chains[chain].merge(*moments)
+        self.total.merge(*moments)
+        self._addHistograms(samples, weights)
+        if loglikes is not None:
+            loglikes = np.asarray(loglikes, dtype=np.float64)
+            self._loglike_sum += weights.dot(loglikes)
+            self._loglike_norm += moments[0]
+            ix = np.argmin(loglikes)
+            if self.best_loglike is None or loglikes[ix] < self.best_loglike:
+                self.best_loglike = loglikes[ix]
+                self.best_sample = samples[ix].copy()
+        if self.keep_samples:
+            self.chain_samples.setdefault(chain, []).append(
+                (samples.copy(), weights.copy(), None if loglikes is None else loglikes.copy()))
+        self.num_rows += samples.shape[0]
+        return self
+
+    def readFile(self, filename, chain=None):
+        """
+        Read any complete rows added to a chain text file since the last call, and add them.
+        Files are in the standard format of weight, -log(Likelihood), then parameter values in each row.
+
+        :param filename: the file name
+        :param chain: identifier for the chain; defaults to the file name
+        :return: number of new rows read
+        """
+        offset = self._file_offsets.get(filename, 0)
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return 0
+        self._file_offsets[filename] = offset + end
+        rows = np.loadtxt(io.BytesIO(data[:end]), ndmin=2)
+        if not rows.size:
+            return 0
+        self.add(rows[:, 2:], rows[:, 0], rows[:, 1], chain=filename if chain is None else chain)
+        return rows.shape[0]
+
+    def readChainFiles(self, root, ext='.txt', **kwargs):
+        """
+        Read new rows from all the chain files for a given root name (see :func:`~.chains.chainFiles`).
+
+        :param root: root name of the chain files
+        :param ext: extension for the files
+        :param kwargs: other arguments for :func:`~.chains.chainFiles`
+        :return: total number of new rows read
+        """
+        return sum(self.readFile(fname) for fname in sorted(chainFiles(root, ext=ext, **kwargs)))
+
+    def _checkSamples(self):
+        if self.total is None or not self.total.norm:
+            raise WeightedSampleError('No samples have been added')
+
+    def getMeans(self):
+        """
+        :return: array of weighted parameter means
+        """
+        self._checkSamples()
+        return self.total.mean.copy()
+
+    def getCov(self):
+        """
+        :return: weighted covariance matrix of the parameters
+        """
+        self._checkSamples()
+        return self.total.getCov()
+
+    def getVars(self):
+        """
+        :return: array of weighted parameter variances
+        """
+        return np.diag(self.getCov()).copy()
+
+    def getChainStatistics(self):
+        """
+        Gets the normalization, means and covariance of each separate chain.
+
+        :return: tuple of arrays norms (n_chains), means (n_chains x n), and covariances (n_chains x n x n)
+        """
+        self._checkSamples()
+        chains = list(self.chains.values())
+        return (np.array([chain.norm for chain in chains]), np.array([chain.mean for chain in chains]),
+                np.array([chain.getCov() for chain in chains]))
+
+    def getGelmanRubinEigenvalues(self, nparam=None):
+        """
+        Assess convergence using var(mean)/mean(var) in the orthogonalized parameters, using the separate chains
+        c.f. Brooks and Gelman 1997.
+
+        :param nparam: The number of parameters (starting at first), by default uses all of them
+        :return: array of  var(mean)/mean(var) for orthogonalized parameters
+        """
+        _, chain_means, chain_covs = self.getChainStatistics()
+        if chain_means.shape[0] < 2:
+            raise WeightedSampleError('Need at least two chains for Gelman-Rubin')
+        nparam = nparam or self.n
+        return _gelman_rubin_eigenvalues(self.total.mean[:nparam], chain_means[:, :nparam],
+                                         chain_covs[:, :nparam, :nparam])
+
+    def getGelmanRubin(self, nparam=None):
+        """
+        Assess the convergence using the maximum var(mean)/mean(var) of orthogonalized parameters
+        c.f. Brooks and Gelman 1997.
+
+        :param nparam: The number of parameters, by default uses all
+        :return: The worst var(mean)/mean(var) for orthogonalized parameters. Should be <<1 for good convergence.
+        """
+        return np.max(self.getGelmanRubinEigenvalues(nparam))
+
+    def getMeanLoglike(self):
+        """
+        :return: weighted mean of -log(Likelihood), or None if no likelihoods were added
+        """
+        return self._loglike_sum / self._loglike_norm if self._loglike_norm else None
+
+    def get1DHistogram(self, name, normalized=True):
+        """
+        Get the weighted histogram of a parameter on the fixed grid.
+
+        :param name: parameter name or index
+        :param normalized: if True, normalize to a probability density
+        :return: a :class:`~.densities.Density1D` instance with the bin centres and histogram values
+        """
+        self._checkSamples()
+        i = name if isinstance(name, int) else self.paramNames.numberOfName(name)
+        if i < 0:
+            raise WeightedSampleError('Parameter not found: %s' % name)
+        x = self.hist_min[i] + (np.arange(self.hist_bins) + 0.5) * self.hist_width[i]
+        P = self.hist[i] / (self.total.norm * self.hist_width[i]) if normalized else self.hist[i].copy()
+        return Density1D(x, P)
+
+    def twoTailLimits(self, contours=(0.68, 0.95)):
+        """
+        Get approximate two-tail marginalized limits from the fixed-grid histograms, interpolating linearly within
+        bins. Limits falling outside the histogram range are set to the range boundaries.
+
+        :param contours: list of confidence levels
+        :return: n_params x n_contours x 2 array of lower and upper limits
+        """
+        self._checkSamples()
+        cum = np.hstack((self.underflow[:, np.newaxis], self.hist)).cumsum(axis=1) / self.total.norm
+        res = np.empty((self.n, len(contours), 2))
+        for i in range(self.n):
+            edges = self.hist_min[i] + np.arange(self.hist_bins + 1) * self.hist_width[i]
+            probs = np.array([[(1 - c) / 2, (1 + c) / 2] for c in contours])
+            res[i] = np.interp(probs, cum[i], edges)
+        return res
+
+    def getMargeStats(self, contours=(0.68, 0.95, 0.99)):
+        """
+        Get a :class:`~.types.MargeStats` summary of the current samples, with means, standard deviations and
+        approximate two-tail limits from the fixed-grid histograms (accurate to about the bin width).
+
+        :param contours: list of confidence levels
+        :return: A :class:`~.types.MargeStats` instance
+        """
+        lims = self.twoTailLimits(contours)
+        means = self.getMeans()
+        errs = np.sqrt(self.getVars())
+        m = types.MargeStats()
+        m.hasBestFit = False
+        m.limits = list(contours)
+        m.names = []
+        for i, par in enumerate(self.paramNames.names):
+            par = copy.copy(par)
+            par.mean = means[i]
+            par.err = errs[i]
+            par.limits = [types.ParamLimit(lim) for lim in lims[i]]
+            m.names.append(par)
+        return m
+
+    def makeMCSamples(self, **kwargs):
+        """
+        Make a :class:`~.mcsamples.MCSamples` instance from the stored samples (requires keep_samples=True).
+
+        :param kwargs: other arguments for :class:`~.mcsamples.MCSamples`
+        :return: A :class:`~.mcsamples.MCSamples` instance with the samples added so far, one chain per chain id
+        """
+        from getdist.mcsamples import MCSamples
+        if not self.keep_samples:
+            raise WeightedSampleError('makeMCSamples requires keep_samples=True')
+        self._checkSamples()
+        samples, weights, loglikes = [], [], []
+        for blocks in self.chain_samples.values():
+            samples.append(np.vstack([block[0] for block in blocks]))
+            weights.append(np.hstack([block[1] for block in blocks]))
+            if all(block[2] is not None for block in blocks):
+                loglikes.append(np.hstack([block[2] for block in blocks]))
+        if len(loglikes) < len(samples):
+            loglikes = None
+        if len(samples) == 1:
+            samples, weights = samples[0], weights[0]
+            if loglikes is not None:
+                loglikes = loglikes[0]
+        kwargs.setdefault('names', self.paramNames.list())
+        kwargs.setdefault('labels', self.paramNames.labels())
+        return MCSamples(samples=samples, weights=weights, loglikes=loglikes, **kwargs)
@@ -2,11 +2,13 @@ import tempfile
 import os
 import numpy as np
 import unittest
+from unittest import mock
 import subprocess
 import shutil
 from getdist import loadMCSamples, plots, IniFile
 from getdist.tests.test_distributions import Test2DDistributions, Gaussian1D, Gaussian2D
-from getdist.mcsamples import MCSamples
+from getdist.mcsamples import MCSamples, MCSamplesError, BinningPlan
+from getdist.chains import ParamError
 from getdist.styles.tab10 import style_name as tab10
 from getdist.styles.planck import style_name as planck
 from getdist.parampriors import ParamBounds
@@ -104,6 +106,17 @@ class GetDistTest(unittest.TestCase):
         bestSample = samples.getParamBestFitDict(best_sample=True)
         self.assertAlmostEqual(bestSample['loglike'], 1.708, 2)
 
+    def testLikeStats(self):
+        samples = self.testdists.bimodal[0].MCSamples(5000, logLikes=True, random_state=10)
+        samples.updateBaseStatistics()
+        self.assertIsNone(samples.likeStats)
+        stats = samples.getLikeStats()
+        order = np.argsort(samples.loglikes)
+        for j, par in enumerate(stats.names):
+            for i, cont in enumerate(stats.ND_contours):
+                self.assertEqual(par.ND_limit_bot[i], np.min(samples.samples[order[:cont], j]))
+                self.assertEqual(par.ND_limit_top[i], np.max(samples.samples[order[:cont], j]))
+
     def testTables(self):
         self.samples = self.testdists.bimodal[0].MCSamples(12000, logLikes=True, random_state=10)
         self.assertEqual(str(self.samples.getLatex(limit=2)),
@@ -178,6 +191,492 @@ class GetDistTest(unittest.TestCase):
         self.assertAlmostEqual(mean, meanChains)
         self.assertAlmostEqual(mean, float(np.mean(fromChains['x'])))
 
+    def testConfidence(self):
+        samples = self.testdists.bimodal[0].MCSamples(12000, logLikes=True, random_state=10)
+        x = samples.samples[:, 0].copy()
+        limits = np.array([0.025, 0.5, 0.975])
+        self.assertTrue(np.allclose(samples.confidence(0, limits), samples.confidence(x, limits)))
+        self.assertTrue(np.allclose(samples.confidence(0, limits, start=1000, end=5000),
+                                    samples.confidence(x, limits, start=1000, end=5000)))
+        lower, upper = samples.confidences([(0, 0.05, 200, 8000), (1, limits)], upper=True)
+        self.assertAlmostEqual(lower, samples.confidence(x, 0.05, upper=True, start=200, end=8000))
+        self.assertTrue(np.allclose(upper, samples.confidence(samples.samples[:, 1].copy(), limits, upper=True)))
+
+    def testAutoCorrelations(self):
+        from getdist.convolve import autoConvolve, autoConvolveColumns
+        x = np.random.default_rng(10).normal(size=(1000, 3))
+        cols = autoConvolveColumns(x, 20)
+        for j in range(3):
+            self.assertTrue(np.allclose(cols[:, j], autoConvolve(x[:, j], 20)))
+        self.assertTrue(np.isclose(cols[5, 1], np.dot(x[5:, 1], x[:-5, 1]) / 995))
+        cols = autoConvolveColumns(x[:10], 20)
+        self.assertEqual(cols.shape, (10, 3))
+        self.assertTrue(np.allclose(cols[:, 2], autoConvolve(x[:10, 2], 10)))
+
+    def testSpectrumCache(self):
+        from getdist.convolve import convolve2D, SpectrumCache, spectrum_cache
+        cache = SpectrumCache(max_bytes=2000)
+        cache['a'], cache['b'] = np.zeros(100), np.ones(100)
+        self.assertIsNotNone(cache.get('a'))
+        cache['c'] = np.ones(100)
+        self.assertEqual((cache.get('b'), len(cache), cache.nbytes), (None, 2, 1600))
+        x = np.random.default_rng(1).normal(size=(40, 40))
+        win = np.outer(np.hanning(9), np.hanning(7))
+        spectrum_cache.clear()
+        res = convolve2D(x, win, 'same', shared_args=[2])
+        self.assertEqual(len(spectrum_cache), 1)
+        self.assertTrue(np.allclose(res, convolve2D(x, win.copy(), 'same', shared_args=[2])))
+        self.assertEqual(len(spectrum_cache), 1)
+        self.assertTrue(np.allclose(res, convolve2D(x, win, 'same')))
+
+    def testFFTBackend(self):
+        from getdist import convolve
+        x = np.random.default_rng(2).normal(size=(50, 30))
+        win = np.outer(np.hanning(11), np.hanning(9))
+        self.assertEqual(convolve.fastFFTSize(97), 100)
+        self.assertTrue(np.array_equal(convolve.fastFFTSize(np.array([7, 61])), [8, 64]))
+        try:
+            res = [convolve.convolve2D(x, win, 'same'), convolve.convolveGaussianDCT(x[:, 0], 2.5, cache={}),
+                   convolve.dct2d(x)]
+            for backend, workers in [('numpy', 1), ('scipy', 0)]:
+                convolve.setFFTBackend(backend, workers)
+                for a, b in zip(res, [convolve.convolve2D(x, win, 'same'),
+                                      convolve.convolveGaussianDCT(x[:, 0], 2.5, cache={}), convolve.dct2d(x)]):
+                    self.assertTrue(np.allclose(a, b))
+            self.assertTrue(np.allclose(convolve.idct2d(res[2]) / (4 * x.size), x))
+        finally:
+            convolve.setFFTBackend()
+        from scipy import signal
+        self.assertTrue(np.allclose(res[0], signal.convolve(x, win, 'same')))
+        with self.assertRaises(ValueError):
+            convolve.setFFTBackend('fftpack')
+
+    def testLowRankConvolution(self):
+        from getdist.convolve import convolve2D, convolveLowRank, lowRankFactors
+        ix1, ix2 = np.mgrid[-8:9, -8:9]
+        mask_y, mask_x = np.ones(60), np.ones(50)
+        mask_y[:8] = 0
+        mask_y[8] = 0.5
+        mask_x[-3:] = 0
+        for corr in [0, 0.8]:
+            win = np.exp(-(ix1 ** 2 + ix2 ** 2 - 2 * corr * ix1 * ix2) / (2 * 3.5 ** 2 * (1 - corr ** 2)))
+            factors = lowRankFactors(win)
+            self.assertEqual(len(factors) == 1, not corr)
+            for mode in ['valid', 'same']:
+                self.assertTrue(np.allclose(convolveLowRank(mask_y, mask_x, factors, mode),
+                                            convolve2D(np.outer(mask_y, mask_x), win, mode)))
+        self.assertIsNone(lowRankFactors(win, max_rank=2))
+
+    def testMaskMomentCache(self):
+        from getdist.mcsamples import mask_moment_cache
+        samples = self.testdists.cut_correlated.MCSamples(12000, logLikes=False, random_state=10)
+        mask_moment_cache.clear()
+        density = samples.get2DDensity('x', 'y')
+        density1D = samples.get1DDensity('x', boundary_correction_order=2)
+        cached = list(mask_moment_cache._items.values())
+        self.assertGreater(len(cached), 0)
+        samples.updateSettings({'smooth_scale_2D': -1})
+        self.assertTrue(np.array_equal(density.P, samples.get2DDensity('x', 'y').P))
+        self.assertTrue(np.array_equal(density1D.P, samples.get1DDensity('x', boundary_correction_order=2).P))
+        # cached arrays are reused rather than recalculated
+        self.assertTrue(all(a is b for a, b in zip(cached, mask_moment_cache._items.values())))
+        self.assertEqual(len(mask_moment_cache), len(cached))
+
+    def testSinglePrecision2D(self):
+        from getdist.convolve import convolve2D
+        x = np.random.default_rng(4).random((40, 30))
+        self.assertEqual(convolve2D(x, np.ones((5, 5)), 'same', dtype=np.float32).dtype, np.float32)
+        samples = self.testdists.cut_correlated.MCSamples(12000, logLikes=True, random_state=10)
+        density = samples.get2DDensityGridData('x', 'y', meanlikes=True)
+        single = samples.get2DDensityGridData('x', 'y', meanlikes=True, single_precision_2D=True)
+        self.assertEqual(single.P.dtype, np.float64)
+        # same contours at plotting precision
+        self.assertTrue(np.allclose(density.P, single.P, atol=1e-5))
+        self.assertTrue(np.allclose(density.likes, single.likes, atol=1e-5))
+        self.assertTrue(np.allclose(density.contours, single.contours, rtol=1e-4))
+
+    def testMultiKernelConvolution(self):
+        from getdist.convolve import convolve1DRows, convolve1DRowsMulti, convolveFFTn, convolveFFTnMulti
+        rng = np.random.default_rng(3)
+        x = rng.random((40, 30))
+        kernels = rng.random((3, 7, 5))
+        rows = rng.random((3, 40, 9))
+        for mode in ['same', 'valid', 'full']:
+            res = convolveFFTnMulti(x, kernels, mode, largest_size=60)
+            self.assertTrue(np.allclose(res, [convolveFFTn(x, kernel, mode) for kernel in kernels]))
+            res = convolve1DRowsMulti(x, rows, mode)
+            self.assertTrue(np.array_equal(res, [convolve1DRows(x, kernel, mode) for kernel in rows]))
+
+    def testChainStatistics(self):
+        samps = [Gaussian2D([1.5, -2], np.diagflat([1, 2])).MCSamples(1001 + i * 10, names=['x', 'y'],
+                                                                      random_state=i) for i in range(3)]
+        fromChains = MCSamples(samples=[s.samples for s in samps], names=['x', 'y'])
+        norms, means, covs = fromChains.getChainStatistics()
+        for i, chain in enumerate(fromChains.getSeparateChains()):
+            self.assertAlmostEqual(norms[i], chain.norm)
+            self.assertTrue(np.allclose(means[i], chain.getMeans()))
+            self.assertTrue(np.allclose(covs[i], chain.getCov()))
+        self.assertTrue(np.allclose(fromChains.getGelmanRubinEigenvalues(),
+                                    fromChains.getGelmanRubinEigenvalues(chainlist=samps)))
+        # separate chain objects are only made for tests that use them
+        tests = fromChains.getConvergeTests()
+        with mock.patch.object(fromChains, 'getSeparateChains') as getSeparateChains:
+            stats = fromChains.getConvergeTests(what=('MeanVar', 'GelmanRubin', 'SplitTest'))
+            getSeparateChains.assert_not_called()
+        self.assertIn(stats, tests)
+
+    def testCov(self):
+        from getdist import chains
+        samples = self.testdists.bending.MCSamples(5000, random_state=3)
+        samples.weights = np.arange(samples.numrows) % 4 + 1.
+        samples._weightsChanged()
+        where = samples.samples[:, 0] > 0
+        block_size = chains.cov_block_size
+        try:
+            chains.cov_block_size = 100
+            self.assertTrue(np.allclose(samples.getCov(), np.cov(samples.samples.T, aweights=samples.weights,
+                                                                 ddof=0)))
+            self.assertTrue(np.allclose(samples.cov([1], where=where),
+                                        np.cov(samples.samples[where, 1], aweights=samples.weights[where], ddof=0)))
+            self.assertTrue(np.allclose(samples.cov([samples.samples[:, 1] * 2, 0]),
+                                        samples.getCov()[::-1, ::-1] * [[4, 2], [2, 1]]))
+            with self.assertRaises(ParamError):
+                samples.cov([0, 2])
+            # negative weights, e.g. from importance sampling
+            samples.weights[::7] *= -0.1
+            samples._weightsChanged()
+            diffs = samples.samples - samples.getMeans()
+            self.assertTrue(np.allclose(samples.getCov(), (samples.weights * diffs.T).dot(diffs) / samples.norm))
+        finally:
+            chains.cov_block_size = block_size
+
+    def testQuantiles(self):
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        p = samples.getParams()
+        samples.addDerived(p.x * p.y, 'xy')
+        probs = [0.025, 0.5, 0.975]
+        quantiles = samples.quantiles(['y', 'xy', 0], probs, max_workers=2)
+        self.assertEqual(quantiles.shape, (3, 3))
+        for par, row in zip([1, 2, 0], quantiles):
+            self.assertTrue(np.allclose(row, [samples.confidence(par, prob) for prob in probs]))
+        self.assertTrue(np.allclose(samples.quantiles([p.x], probs), quantiles[2]))
+
+    def testThreadedMarge(self):
+        samples = self.testdists.cut_correlated.MCSamples(12000, logLikes=True, random_state=10)
+        p = samples.getParams()
+        samples.addDerived(p.x * p.y, 'xy')
+        threaded = MCSamples(samples=samples.samples, loglikes=samples.loglikes, names=samples.paramNames,
+                             ranges=samples.ranges, settings={'num_threads': 3})
+        self.assertEqual(threaded.getTable().tableTex(), samples.getTable().tableTex())
+        for name in ['x', 'y', 'xy']:
+            self.assertTrue(np.allclose(threaded.get1DDensity(name).P, samples.get1DDensity(name).P))
+
+    def testLazyMargeStats(self):
+        samples = self.testdists.bimodal[0].MCSamples(12000, logLikes=True, random_state=10)
+        p = samples.getParams()
+        samples.addDerived(p.x * p.y, 'xy')
+        self.assertEqual(samples.getInlineLatex('y', limit=2), 'y = 0.0^{+1.3}_{-1.3}')
+        self.assertEqual(set(samples.density1D), {'y'})
+        table = samples.getTable(limit=1, paramList=['x']).tableTex()
+        self.assertEqual(set(samples.density1D), {'x', 'y'})
+        self.assertTrue(r'0.0\pm 1.2' in table)
+        self.assertEqual(samples.getMargeStats(params=['x*']).list(), ['x', 'xy'])
+        self.assertEqual(str(samples.getLatex(limit=2)),
+                         "(['x', 'y', 'xy'], ['0.0^{+2.1}_{-2.1}', '0.0^{+1.3}_{-1.3}', '0.0^{+1.7}_{-1.8}'])")
+
+    def testBatched1D(self):
+        samples = self.testdists.bimodal[0].MCSamples(5000, logLikes=True, random_state=3)
+        p = samples.getParams()
+        samples.addDerived(np.abs(p.x), 'absx', range=[0, None])
+        samples.updateSettings({'boundary_correction_order': 1, 'mult_bias_correction_order': 1})
+        densities = samples.get1DDensities(meanlikes=True)
+        samples2 = samples.copy()
+        for density, name in zip(densities, samples.getParamNames().list()):
+            single = samples2.get1DDensityGridData(name, meanlikes=True)
+            self.assertTrue(np.allclose(density.P, single.P))
+            self.assertTrue(np.allclose(density.likes, single.likes))
+        # reference values from the unbatched algorithm, for (mult_bias_correction_order, boundary_correction_order)
+        xs = {'x': [-1.5, -0.5, 0.5, 1.5], 'absx': [0, 0.1, 0.5, 1.5]}
+        reference = {(0, 0): {'x': [0.735645, 0.872072, 0.855335, 0.769443],
+                              'absx': [0.679338, 0.68407, 0.86222, 0.755201]},
+                     (0, 1): {'x': [0.735645, 0.872072, 0.855335, 0.769443],
+                              'absx': [0.693426, 0.673691, 0.86222, 0.755201]},
+                     (0, 2): {'x': [0.715548, 0.866823, 0.839728, 0.76983],
+                              'absx': [0.671022, 0.675981, 0.87167, 0.751778]},
+                     (1, 0): {'x': [0.720486, 0.870776, 0.850458, 0.767408],
+                              'absx': [0.686173, 0.710655, 0.870978, 0.75477]},
+                     (1, 1): {'x': [0.720486, 0.870776, 0.850458, 0.767408],
+                              'absx': [0.640463, 0.67843, 0.879533, 0.752451]},
+                     (1, 2): {'x': [0.712615, 0.861646, 0.833627, 0.766184],
+                              'absx': [0.659871, 0.664618, 0.864546, 0.751425]}}
+        for (mult, bound), values in reference.items():
+            samples2 = samples.copy()
+            samples2.updateSettings({'boundary_correction_order': bound, 'mult_bias_correction_order': mult})
+            densities = dict(zip(samples2.getParamNames().list(), samples2.get1DDensities()))
+            for name, expected in values.items():
+                self.assertTrue(np.allclose(densities[name].Prob(xs[name]), expected, rtol=0, atol=2e-6))
+
+    def testBinningPlan(self):
+        samples = self.testdists.bimodal[0].MCSamples(5000, logLikes=True, random_state=4)
+        p = samples.getParams()
+        samples.addDerived(p.y ** 2, 'z')
+        density = samples.get2DDensity('x', 'y')
+        samples.get2DDensity('x', 'z')
+        plan = samples._binning_plan
+        self.assertEqual(set(plan.bins), {(0, 256), (1, 256), (2, 256)})
+        self.assertEqual(plan.bins[(0, 256)][0].dtype, np.int16)
+        self.assertTrue(np.array_equal(density.P, samples.get2DDensity('x', 'y').P))
+        samples.changeDerived(p.y ** 2 + 1, 'z')
+        self.assertEqual(set(plan.bins), {(0, 256), (1, 256)})
+        new = samples.copy()
+        new._binning_plan = BinningPlan()
+        self.assertTrue(np.allclose(new.get2DDensity('x', 'z').P, samples.get2DDensity('x', 'z').P))
+
+    def testParallel2D(self):
+        samples = self.testdists.bimodal[0].MCSamples(5000, logLikes=True, random_state=5)
+        p = samples.getParams()
+        samples.addDerived(p.x + p.y, 'z')
+        pairs = [['x', 'y'], ['x', 'z'], ['y', 'z']]
+        densities = samples.copy().get2DDensities(pairs, meanlikes=True, max_workers=3)
+        for pair, density in zip(pairs, densities):
+            single = samples.get2DDensityGridData(*pair, meanlikes=True)
+            self.assertTrue(np.array_equal(density.P, single.P))
+            self.assertTrue(np.array_equal(density.likes, single.likes))
+        samples.updateSettings({'num_threads': 2})
+        g = plots.get_subplot_plotter()
+        g.triangle_plot(samples, filled=True)
+        self.assertEqual(len(g.sample_analyser.densities_2D[samples]), 3)
+        plt.close('all')
+
+    def testSharedMemoryPool(self):
+        from getdist.parallel import SharedMemoryPool
+        samples = self.testdists.bimodal[0].MCSamples(4000, logLikes=True, random_state=6)
+        ref = samples.copy()
+        with SharedMemoryPool(samples, max_workers=2) as pool:
+            densities = pool.get1DDensities()
+            self.assertTrue(np.allclose(densities[1].P, ref.get1DDensity('y').P))
+            density = pool.get2DDensities([['x', 'y']], meanlikes=True)[0]
+            self.assertTrue(np.array_equal(density.P, ref.get2DDensityGridData('x', 'y', meanlikes=True).P))
+            errors = samples.getResampledErrors(blocks=400, num_resamples=6, random_state=2, pool=pool)
+        self.assertTrue(np.allclose(errors.limits, ref.getResampledErrors(blocks=400, num_resamples=6,
+                                                                          random_state=2).limits))
+
+    def testDerivedUpdate(self):
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        samples.getMargeStats()
+        samples.getLikeStats()
+        density = samples.get1DDensity('x')
+        p = samples.getParams()
+        samples.addDerived(p.x * p.y, 'xy', range=[None, 3])
+        samples.addDerived(p.x + p.y, 'z')
+        samples.changeDerived(p.x - p.y ** 2, 'z')
+        self.assertIs(samples.get1DDensity('x'), density)
+        stats = [(par.mean, par.err, par.limits[1].lower, par.limits[1].upper, par.ND_limit_top[0])
+                 for par in samples.getMargeStats().names]
+        cov = samples.getCov().copy()
+        samples.updateBaseStatistics()
+        samples.getLikeStats()
+        self.assertTrue(np.allclose(cov, samples.getCov()))
+        self.assertTrue(np.allclose(stats, [(par.mean, par.err, par.limits[1].lower, par.limits[1].upper,
+                                             par.ND_limit_top[0]) for par in samples.getMargeStats().names]))
+        # samples changed in place, then updated
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        limits = samples.confidence(0, np.array([0.025, 0.975]))
+        samples.getInlineLatex('x')
+        samples.samples[:, 0] = -samples.samples[:, 0]
+        samples.updateBaseStatistics()
+        self.assertTrue(np.allclose(samples.confidence(0, np.array([0.025, 0.975])), -limits[::-1], atol=0.1))
+        fresh = MCSamples(samples=samples.samples.copy(), weights=samples.weights, loglikes=samples.loglikes,
+                          names=samples.getParamNames().list())
+        self.assertEqual(samples.getInlineLatex('x'), fresh.getInlineLatex('x'))
+
+    def testLazyDerived(self):
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        p = samples.getParams()
+        samples.addDerivedExpr('r', 'sqrt(x**2 + y**2)', label='r')
+        samples.addDerivedExpr('r2', 'r**2 + np.abs(x)')
+        samples.addDerivedExpr('xy', lambda pars: pars.x * pars.y, range=[None, 2])
+        self.assertEqual(samples.paramNames.list(), ['x', 'y'])
+        self.assertAlmostEqual(samples.mean('r2'),
+                               np.average(p.x ** 2 + p.y ** 2 + np.abs(p.x), weights=samples.weights))
+        self.assertEqual(samples.paramNames.list(), ['x', 'y', 'r', 'r2'])
+        self.assertEqual(samples.get1DDensity('xy').view_ranges[1], 2)
+        samples.dropLazyDerived('r*')
+        self.assertEqual(samples.paramNames.list(), ['x', 'y', 'xy'])
+        self.assertEqual(samples.getCov().shape, (3, 3))
+        self.assertTrue(np.allclose(samples.getParams().xy, p.x * p.y))
+        self.assertTrue(np.allclose(samples.getMeans(), samples.weights.dot(samples.samples) / samples.norm))
+        self.assertAlmostEqual(samples.mean('r'), np.average(np.sqrt(p.x ** 2 + p.y ** 2), weights=samples.weights))
+        # all-parameter results include lazy derived parameters
+        samples.dropLazyDerived()
+        self.assertEqual([par.name for par in samples.getMargeStats().names], ['x', 'y', 'r', 'r2', 'xy'])
+        samples.dropLazyDerived()
+        self.assertTrue(np.allclose(samples.getParams().r, np.sqrt(p.x ** 2 + p.y ** 2)))
+        samples.dropLazyDerived()
+        self.assertEqual(len(samples.get1DDensities()), 5)
+        self.assertIn('r2', samples.getTable().tableTex())
+        # functions can use other lazy derived parameters; unknown names in expressions are errors
+        samples.dropLazyDerived()
+        samples.addDerivedExpr('r3', lambda pars: 2 * pars.r)
+        self.assertAlmostEqual(samples.mean('r3'), 2 * samples.mean('r'))
+        samples.addDerivedExpr('bad', 'x + e')
+        with self.assertRaises(ParamError):
+            samples.mean('bad')
+
+    def testImportanceVariants(self):
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        variants = samples.importanceSampleVariants(lambda p: [(p.x - 1) ** 2 / 2, p.y ** 2], max_workers=2)
+        self.assertEqual(len(variants), 2)
+        p = samples.getParams()
+        for variant, logLikes in zip(variants, [(p.x - 1) ** 2 / 2, p.y ** 2]):
+            self.assertTrue(np.shares_memory(variant.samples, samples.samples))
+            self.assertFalse(variant.samples.flags.writeable)
+            reweighted = samples.copy()
+            reweighted.reweightAddingLogLikes(logLikes)
+            self.assertTrue(np.allclose(variant.getCov(), reweighted.getCov()))
+            self.assertEqual(variant.getTable().tableTex(), reweighted.getTable().tableTex())
+            self.assertAlmostEqual(variant.getLikeStats().meanLogLike, reweighted.getLikeStats().meanLogLike)
+        logLikes = np.array([(p.x - 1) ** 2 / 2, p.y ** 2])
+        with self.assertRaises(MCSamplesError):
+            samples.importanceSampleVariants(logLikes, marge_stats=False)
+        self.assertEqual(len(samples.importanceSampleVariants(logLikes.T, marge_stats=False)), 2)
+        self.assertEqual(len(samples.importanceSampleVariants(logLikes[0], marge_stats=False)), 1)
+        # changing a variant leaves the parent and other variants unchanged
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        variants = samples.importanceSampleVariants(logLikes.T, marge_stats=False)
+        x0 = samples.samples[0, 0]
+        variants[0].changeDerived(np.full(samples.numrows, 99.), 'x')
+        self.assertEqual(samples.samples[0, 0], x0)
+        self.assertEqual(variants[1].samples[0, 0], x0)
+        self.assertEqual(variants[0].samples[0, 0], 99.)
+        samples.changeDerived(samples.samples[:, 1] + 1, 'x')
+        self.assertEqual(variants[1].samples[0, 0], x0)
+        self.assertTrue(samples.samples.flags.writeable and samples.loglikes.flags.writeable)
+        # threads are only used if allowed by the num_threads setting
+        with mock.patch('getdist.mcsamples.ThreadPoolExecutor') as executor:
+            samples.importanceSampleVariants(logLikes.T, marge_stats=False)
+            executor.assert_not_called()
+
+    def testCopyOnWrite(self):
+        samples = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        p = samples.getParams()
+        samples.addDerived(p.x * p.y, 'xy')
+        samples.addDerived(p.x + p.y, 'z')
+        means = samples.getMeans().copy()
+        copied = samples.copy()
+        self.assertTrue(np.shares_memory(copied.samples, samples.samples))
+        self.assertFalse(copied.samples.flags.writeable)
+        copied.reweightAddingLogLikes(p.x ** 2)
+        self.assertFalse(np.shares_memory(copied.weights, samples.weights))
+        self.assertTrue(np.allclose(samples.getMeans(), means))
+        subset = samples.getParamSubset(['x', 'xy'])
+        self.assertEqual(subset.paramNames.list(), ['x', 'xy'])
+        self.assertTrue(np.shares_memory(subset.samples, samples.samples))
+        self.assertTrue(np.allclose(subset.getCov(), samples.cov(['x', 'xy'])))
+        subset.changeDerived(p.x * 2, 'xy')
+        self.assertTrue(np.allclose(samples.getParams().xy, p.x * p.y))
+        # the original arrays stay writable
+        for arr in (samples.samples, samples.weights, samples.loglikes):
+            self.assertTrue(arr.flags.writeable)
+        x, z = p.x.copy(), samples.samples[:, 3].copy()
+        samples.samples[:, 3] *= 2
+        samples.weights[:10] = 0
+        samples.getParams().x += 1
+        self.assertTrue(np.allclose(samples.samples[:, 0], x + 1))
+        self.assertTrue(np.allclose(samples.samples[:, 3], 2 * z))
+        self.assertEqual(np.sum(samples.weights[:10]), 0)
+        # changes made by methods of the original do not change the copy
+        samples.changeDerived(z, 'z')
+        self.assertTrue(np.allclose(copied.samples[:, 3], 2 * z))
+        self.assertFalse(np.shares_memory(copied.samples, samples.samples))
+        self.assertFalse(np.shares_memory(copied.weights, samples.weights))
+
+    def testCombineSamples(self):
+        from getdist.mcsamples import combineSamples
+        samps1 = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=1)
+        samps2 = self.testdists.bimodal[0].MCSamples(2000, logLikes=True, random_state=2)
+        samps3 = MCSamples(samples=np.split(samps2.samples[:, ::-1], 2), weights=np.split(samps2.weights, 2),
+                           loglikes=np.split(samps2.loglikes, 2), names=['y', 'x'])
+        combined = combineSamples([samps1, samps3, samps1], sample_weights=[1, 2, 1])
+        self.assertEqual(combined.paramNames.list(), ['x', 'y'])
+        self.assertEqual(list(combined.chain_offsets), [0, 3000, 4000, 5000, 8000])
+        weights = np.concatenate([samps1.weights, samps2.weights * 3, samps1.weights])
+        samples = np.vstack([samps1.samples, samps2.samples, samps1.samples])
+        self.assertTrue(np.allclose(combined.getMeans(), np.average(samples, weights=weights, axis=0)))
+        self.assertEqual(len(combined.getSeparateChains()), 4)
+        pair = samps1.getCombinedSamplesWithSamples(samps2)
+        self.assertTrue(np.allclose(pair.getMeans(), combineSamples([samps1, samps2]).getMeans()))
+
+    def testResampledErrors(self):
+        samps = self.testdists.bimodal[0].MCSamples(12000, logLikes=True, random_state=1)
+        samples = MCSamples(samples=np.split(samps.samples, 6), loglikes=np.split(samps.loglikes, 6), names=['x', 'y'])
+        jackknife = samples.getResampledErrors('jackknife', max_workers=2)
+        self.assertEqual(jackknife.num_resamples, 6)
+        chain_means = np.array([chain.getMeans() for chain in samples.getSeparateChains()])
+        drop_means = (np.sum(chain_means, axis=0) - chain_means) / 5
+        self.assertTrue(np.allclose(jackknife.means, np.sqrt(5 * np.var(drop_means, axis=0))))
+        with mock.patch('getdist.mcsamples.ThreadPoolExecutor') as executor:
+            bootstrap = samples.getResampledErrors(num_resamples=20, blocks='correlation', random_state=1)
+            executor.assert_not_called()
+        self.assertEqual(bootstrap.limits.shape, (2, len(samples.contours), 2))
+        self.assertEqual(bootstrap.like_limits.shape, bootstrap.limits.shape)
+        sddev = np.sqrt(np.diag(samples.getCov()))
+        self.assertTrue(np.all(bootstrap.means < sddev / 20) and np.all(bootstrap.limits < sddev[:, None, None] / 5))
+
+        # dropped blocks have zero weight, and must not contribute to the N-D likelihood limits or best fit
+        lengths = np.full(6, 2000)
+        counts = 1 - np.eye(6)
+        means = counts.dot(chain_means) / 5
+        variants = samples._weightVariants(lambda i: samples.weights * np.repeat(counts[i], lengths), means,
+                                           None, False, 1)
+        chains = np.split(np.arange(12000), 6)
+        for i, variant in enumerate(variants):
+            rows = np.concatenate([chain for k, chain in enumerate(chains) if k != i])
+            subset = MCSamples(samples=samps.samples[rows], loglikes=samps.loglikes[rows], names=['x', 'y'])
+            stats, ref = variant.getLikeStats(), subset.getLikeStats()
+            self.assertTrue(np.array_equal(stats.ND_contours, ref.ND_contours))
+            self.assertEqual(stats.logLike_sample, ref.logLike_sample)
+            for par, ref_par in zip(stats.names, ref.names):
+                self.assertTrue(np.array_equal(par.ND_limit_bot, ref_par.ND_limit_bot))
+                self.assertTrue(np.array_equal(par.ND_limit_top, ref_par.ND_limit_top))
+                self.assertEqual(par.bestfit_sample, ref_par.bestfit_sample)
+
+    def testStreaming(self):
+        from getdist.streaming import StreamingSamples
+        samps = self.testdists.bimodal[0].MCSamples(3000, logLikes=True, random_state=10)
+        weights = np.arange(3000) % 3 + 1.
+        samples = MCSamples(samples=np.split(samps.samples, 3), weights=np.split(weights, 3),
+                            loglikes=np.split(samps.loglikes, 3), names=['x', 'y'])
+        stream = StreamingSamples(names=['x', 'y'], keep_samples=True)
+        for chain in range(3):
+            for block in range(1000 * chain, 1000 * (chain + 1), 150):
+                rows = slice(block, min(block + 150, 1000 * (chain + 1)))
+                stream.add(samps.samples[rows], weights[rows], samps.loglikes[rows], chain=chain)
+        self.assertTrue(np.allclose(stream.getMeans(), samples.getMeans()))
+        self.assertTrue(np.allclose(stream.getCov(), samples.getCov()))
+        self.assertTrue(np.allclose(stream.getGelmanRubinEigenvalues(), samples.getGelmanRubinEigenvalues()))
+        self.assertAlmostEqual(stream.best_loglike, np.min(samps.loglikes))
+        lims = stream.twoTailLimits([0.9])
+        self.assertTrue(np.allclose(lims[0, 0], samples.twoTailLimits('x', 0.9), atol=2 * stream.hist_width[0]))
+        self.assertTrue(np.allclose(stream.makeMCSamples().getMeans(), samples.getMeans()))
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tempdir, 'chain_1.txt')
+            stream = StreamingSamples()
+            data = np.hstack((weights[:, np.newaxis], samps.loglikes[:, np.newaxis], samps.samples))
+            with open(fname, 'w') as f:
+                np.savetxt(f, data[:1000])
+                f.write('1 2')
+            self.assertEqual(stream.readChainFiles(os.path.join(tempdir, 'chain')), 1000)
+            with open(fname, 'a') as f:
+                f.write(' 3 4\n')
+                np.savetxt(f, data[1001:])
+            self.assertEqual(stream.readFile(fname), 2000)
+            self.assertAlmostEqual(stream.total.norm, np.sum(weights[:1000]) + 1 + np.sum(weights[1001:]))
+        finally:
+            shutil.rmtree(tempdir)
+
     def testMixtures(self):
         from getdist.gaussian_mixtures import Mixture2D, GaussianND
 
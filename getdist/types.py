@@ -887,6 +887,42 @@ class LikeStats(ParamResults):
         return text
 
 
+class ResampledErrors:
+    """
+    Monte-Carlo error estimates from resampling blocks of samples (bootstrap or jackknife),
+    as returned by :meth:`~.mcsamples.MCSamples.getResampledErrors`.
+
+    :ivar names: list of :class:`~.paramnames.ParamInfo` for the parameters
+    :ivar method: the resampling method ("bootstrap" or "jackknife")
+    :ivar num_resamples: the number of resamples
+    :ivar num_blocks: the number of blocks of samples
+    :ivar means: errors on the parameter means
+    :ivar limits: errors on the marginalized limits, array (param x contour x [lower, upper])
+    :ivar like_limits: errors on the N-D likelihood limits, array (param x contour x [lower, upper]), or None
+    """
+
+    def __init__(self, names, method, num_resamples, num_blocks, means, limits, like_limits=None):
+        self.names = names
+        self.method = method
+        self.num_resamples = num_resamples
+        self.num_blocks = num_blocks
+        self.means = means
+        self.limits = limits
+        self.like_limits = like_limits
+
+    def index(self, name):
+        return [par.name for par in self.names].index(name)
+
+    def __str__(self):
+        text = '%s errors from %s resamples of %s blocks\n' % (self.method, self.num_resamples, self.num_blocks)
+        text += '%-20s %12s %12s %12s\n' % ('parameter', 'mean', 'lower', 'upper')
+        for i, par in enumerate(self.names):
+            for contour, (lower, upper) in enumerate(self.limits[i]):
+                text += '%-20s %12s %12.4E %12.4E\n' % (par.name if contour == 0 else '',
+                                                        '%12.4E' % self.means[i] if contour == 0 else '', lower, upper)
+        return text
+
+
 class ConvergeStats(ParamResults):
     def loadFromFile(self, filename):
         try: